@@ -8,13 +8,35 @@ Pro PDF Studio — by Raghu (v3.0)
 import streamlit as st
 import fitz
 import pandas as pd
+import numpy as np
 import io
+import os
+import tempfile
 import base64
+import stat
+import re
+import shutil
+import mmap
 import zipfile
+import json
 import urllib.parse
 import hashlib
+import itertools
+import time
+import threading
+import functools
+import inspect
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import OrderedDict, deque
 from typing import Optional, Tuple, List, Dict
 import logging
+import sys
+import importlib.machinery
+from concurrent.futures.process import BrokenProcessPool
+import pdf_workers
+from pdf_workers import PdfSrc, load_pdf, OCR_WORD_COLS, ocr_page, page_text, page_tables
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -113,10 +135,14 @@ html,body,[class*="css"]{font-family:'Inter',sans-serif;}
 # ─────────────────────────────────────────────
 def init_ss():
     defs = {
-        'viewer_pdf_bytes': None,
+        'viewer_pdf':       None,
+        'viewer_src':       None,
         'processed_pdfs':   {},
         'ocr_available':    None,
         'undo_stack':       [],
+        'ocr_partial':      None,
+        'img_extract':      None,
+        'tables':           None,
         'donation_shown':   False,
     }
     for k, v in defs.items():
@@ -613,43 +639,515 @@ def get_font_name(family:str, bold:bool, italic:bool)->str:
     if italic:          return e["i"]
     return e["n"]
 
+# ═══════════════════════════════════════════════
+# DOCUMENT CACHE  — parsed docs keyed by SHA-256 of the bytes
+# ═══════════════════════════════════════════════
+DOC_CACHE_MAX_DOCS=8     # open fitz handles kept across reruns / sessions
+DOC_CACHE_MAX_MB=256     # total in-memory PDF bytes pinned by those handles
+
+def src_size(src:PdfSrc)->int:
+    return os.path.getsize(src) if isinstance(src,str) else len(src)
+
+def src_bytes(src:PdfSrc)->bytes:
+    if not isinstance(src,str): return src
+    with open(src,"rb") as f: return f.read()
+
+# LRU of open, read-only fitz.Document handles under a handle / byte budget
+class DocCache:
+    def __init__(self,max_docs:int,max_bytes:int):
+        self.max_docs=max_docs; self.max_bytes=max_bytes
+        self.docs=OrderedDict(); self.size=0
+        self.paths={}                # path → (mtime, size, digest)
+        self.lock=threading.Lock(); self.hits=0; self.misses=0
+        self.on_evict=[]             # callbacks(digest) once a handle leaves the cache
+
+    def key(self,src:PdfSrc)->str:
+        if isinstance(src,str):
+            # spooled files are already named by their SHA-256
+            stem=os.path.splitext(os.path.basename(src))[0]
+            if re.fullmatch(r"[0-9a-f]{64}",stem): return stem
+            stt=os.stat(src); memo=self.paths.get(src)
+            if memo and memo[:2]==(stt.st_mtime,stt.st_size): return memo[2]
+            h=hashlib.sha256()
+            with open(src,"rb") as f:
+                for chunk in iter(lambda:f.read(1<<20),b""): h.update(chunk)
+            self.paths[src]=(stt.st_mtime,stt.st_size,h.hexdigest())
+            return h.hexdigest()
+        return hashlib.sha256(src).hexdigest()
+
+    def entry(self,src:PdfSrc,k:Optional[str]=None)->Tuple[fitz.Document,threading.RLock]:
+        # the shared handle and its lock — MuPDF documents aren't thread-safe
+        k=k or self.key(src)
+        with self.lock:
+            ent=self.docs.get(k)
+            if ent and not ent[0].is_closed:
+                self.docs.move_to_end(k); self.hits+=1
+                return ent[0],ent[2]
+        doc=load_pdf(src); n=0 if isinstance(src,str) else len(src); gone=[]
+        with self.lock:
+            self.misses+=1
+            old=self.docs.pop(k,None)
+            if old: self.size-=old[1]; gone.append(k)
+            lock=threading.RLock(); self.docs[k]=(doc,n,lock); self.size+=n
+            # Evicted handles are only dropped, never closed here: another
+            # session may still be reading them. GC closes them afterwards.
+            while len(self.docs)>1 and (len(self.docs)>self.max_docs
+                                        or self.size>self.max_bytes):
+                ok,(_,n,_)=self.docs.popitem(last=False); self.size-=n; gone.append(ok)
+        for ok in gone:
+            for cb in self.on_evict: cb(ok)
+        return doc,lock
+
+@st.cache_resource
+def doc_cache()->DocCache:
+    return DocCache(DOC_CACHE_MAX_DOCS,DOC_CACHE_MAX_MB*1024*1024)
+
+# A shared handle is only used under its lock: pdf_lock (or @pdf_locked) holds
+# it and pins the handle for this thread, so open_pdf / the page cache inside
+# return that same handle even if the DocCache swaps it out meanwhile.
+_PIN=threading.local()   # id(src) → (src, digest, doc, lock) while locked
+
+def pinned(src:PdfSrc)->Optional[Tuple[str,fitz.Document,threading.RLock]]:
+    p=getattr(_PIN,"pins",{}).get(id(src))
+    return p[1:] if p and p[0] is src else None
+
+def pin_entry(src:PdfSrc)->Tuple[str,fitz.Document,threading.RLock]:
+    p=pinned(src)
+    if p is None: k=doc_cache().key(src); p=(k,*doc_cache().entry(src,k))
+    return p
+
+@contextlib.contextmanager
+def pdf_lock(src:PdfSrc,pin=None):
+    k,doc,lock=pin or pin_entry(src)
+    pins=_PIN.__dict__.setdefault("pins",{}); prev=pins.get(id(src))
+    with lock:
+        pins[id(src)]=(src,k,doc,lock)
+        try: yield doc
+        finally:
+            if prev: pins[id(src)]=prev
+            else: pins.pop(id(src),None)
+
+def pdf_locked(fn):
+    # fn(src,…) under pdf_lock(src). A generator keeps one handle for its whole
+    # life but holds the lock only while computing each item, not across yields.
+    if inspect.isgeneratorfunction(fn):
+        @functools.wraps(fn)
+        def gen(src,*a,**kw):
+            pin=pin_entry(src); it=fn(src,*a,**kw)
+            while True:
+                with pdf_lock(src,pin):
+                    try: x=next(it)
+                    except StopIteration: return
+                yield x
+        return gen
+    @functools.wraps(fn)
+    def run(src,*a,**kw):
+        with pdf_lock(src): return fn(src,*a,**kw)
+    return run
+
+def pdf_key(src:PdfSrc)->str:
+    p=pinned(src)
+    return p[0] if p else doc_cache().key(src)
+
+def open_pdf(src:PdfSrc)->fitz.Document:
+    # Shared handle — callers must not modify or close it, and must hold pdf_lock.
+    p=pinned(src)
+    return p[1] if p else doc_cache().entry(src)[0]
+
+# Text analysis per (document, page): the TextPage is built once and every
+# reader (inspect, find / replace, extract text) parses from it; parsed results
+# (dict, CharMap, …) are kept too. A TextPage is only valid together with the
+# Page it came from, so the entry pins that Page (and through it the document);
+# entries are dropped as soon as their document leaves the DocCache, so pages
+# never keep alive a document the DocCache budget has already let go of.
+TEXT_FLAGS=fitz.TEXTFLAGS_TEXT   # == RAWDICT / DICT / BLOCKS flags minus images
+TEXT_CACHE_PAGES=int(os.environ.get("PDF_STUDIO_TEXT_CACHE_PAGES","256"))
+
+class PageCache:
+    def __init__(self,max_pages:int):
+        self.max_pages=max_pages; self.items=OrderedDict()
+        self.lock=threading.Lock(); self.hits=0; self.misses=0
+
+    def entry(self,src:PdfSrc,pn:int)->Dict:
+        doc=open_pdf(src); k=(pdf_key(src),pn)
+        with self.lock:
+            e=self.items.get(k)
+            if e and e["doc"] is doc: self.items.move_to_end(k); self.hits+=1; return e
+        e={"doc":doc,"page":doc[pn],"tp":{},"parsed":{}}
+        with self.lock:
+            self.misses+=1
+            # only pages of the handle the DocCache holds now; a replaced or
+            # evicted handle's pages would outlive it
+            if doc_cache().docs.get(k[0],(None,))[0] is not doc: return e
+            self.items[k]=e
+            while len(self.items)>self.max_pages: self.items.popitem(last=False)
+        return e
+
+    def drop_doc(self,dk:str):
+        with self.lock:
+            for k in [k for k in self.items if k[0]==dk]: del self.items[k]
+
+@st.cache_resource
+def page_cache()->PageCache:
+    pc=PageCache(TEXT_CACHE_PAGES); doc_cache().on_evict.append(pc.drop_doc)
+    return pc
+
+@pdf_locked
+def text_page(src:PdfSrc,pn:int,flags:int=TEXT_FLAGS)->Tuple[fitz.Page,fitz.TextPage]:
+    e=page_cache().entry(src,pn); tp=e["tp"].get(flags)
+    if tp is None: tp=e["tp"][flags]=e["page"].get_textpage(flags=flags)
+    return e["page"],tp
+
+@pdf_locked
+def page_parsed(src:PdfSrc,pn:int,kind:str):
+    # kind: "charmap" or any get_text option ("dict", "rawdict", "text", "blocks", …)
+    e=page_cache().entry(src,pn); v=e["parsed"].get(kind)
+    if v is None:
+        page,tp=text_page(src,pn)
+        v=e["parsed"][kind]=CharMap(page,tp) if kind=="charmap" else page.get_text(kind,textpage=tp)
+    return v
+
+# ═══════════════════════════════════════════════
+# RENDER CACHE  — memory LRU + optional disk tier
+# ═══════════════════════════════════════════════
+@st.cache_resource
+def cache_root()->str:
+    # The default root sits at a predictable path in the shared temp dir: use it
+    # only if it is a real directory we own (then make it 0700), else fall
+    # back to a fresh private one.
+    root=os.environ.get("PDF_STUDIO_CACHE_DIR",os.path.join(tempfile.gettempdir(),"pro_pdf_studio"))
+    try:
+        os.makedirs(root,mode=0o700,exist_ok=True); stt=os.lstat(root)
+        if stat.S_ISDIR(stt.st_mode) and (not hasattr(os,"getuid") or stt.st_uid==os.getuid()):
+            if stt.st_mode&0o077: os.chmod(root,0o700)
+            return root
+    except OSError: pass
+    logger.warning(f"cache dir {root} is not private, using a temporary one")
+    return tempfile.mkdtemp(prefix="pro_pdf_studio_")
+
+CACHE_DIR=cache_root()
+PREVIEW_FORMATS=("png","jpeg","webp")
+PREVIEW_FMT=os.environ.get("PDF_STUDIO_PREVIEW_FMT","jpeg").strip().lower()
+if PREVIEW_FMT=="jpg": PREVIEW_FMT="jpeg"
+if PREVIEW_FMT not in PREVIEW_FORMATS:
+    logger.warning(f"PDF_STUDIO_PREVIEW_FMT={PREVIEW_FMT!r} not in {PREVIEW_FORMATS}, using jpeg")
+    PREVIEW_FMT="jpeg"
+PREVIEW_QUALITY=int(os.environ.get("PDF_STUDIO_PREVIEW_QUALITY","80"))   # jpeg / webp
+PREVIEW_CACHE_MB=64
+PREVIEW_DISK_MB=int(os.environ.get("PDF_STUDIO_PREVIEW_DISK_MB","0"))  # 0 = memory only
+
+# Size-bounded directory of blobs; least recently used files are deleted first
+class DiskCache:
+    def __init__(self,root:str,max_bytes:int):
+        self.root=root; self.max_bytes=max_bytes; self.lock=threading.Lock()
+        os.makedirs(root,exist_ok=True)
+        self.size=sum(e.stat().st_size for e in os.scandir(root) if e.is_file())
+
+    def path(self,k)->str:
+        return os.path.join(self.root,hashlib.sha1(repr(k).encode()).hexdigest())
+
+    def has(self,k)->bool:
+        return os.path.exists(self.path(k))
+
+    def get(self,k)->Optional[bytes]:
+        p=self.path(k)
+        try:
+            with open(p,"rb") as f: data=f.read()
+            os.utime(p)
+            return data
+        except OSError: return None
+
+    def put(self,k,data:bytes):
+        p=self.path(k); tmp=f"{p}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp,"wb") as f: f.write(data)
+            os.replace(tmp,p)
+        except OSError: return
+        with self.lock:
+            self.size+=len(data)
+            if self.size>self.max_bytes: self.evict()
+
+    def evict(self):
+        ents=sorted((e for e in os.scandir(self.root) if e.is_file()),
+                    key=lambda e:e.stat().st_mtime)
+        self.size=sum(e.stat().st_size for e in ents)
+        for e in ents:
+            if self.size<=self.max_bytes*0.9: break
+            try: n=e.stat().st_size; os.remove(e.path); self.size-=n
+            except OSError: pass
+
+def json_loads(data:Optional[bytes]):
+    # a DiskCache hit as JSON; None on a miss or an unreadable entry
+    if data is None: return None
+    try: return json.loads(data)
+    except ValueError: return None
+
+# In-memory LRU of blobs; misses fall through to an optional DiskCache
+class ByteLRU:
+    def __init__(self,max_bytes:int,disk:Optional[DiskCache]=None):
+        self.max_bytes=max_bytes; self.disk=disk
+        self.items=OrderedDict(); self.size=0; self.lock=threading.Lock()
+
+    def get(self,k)->Optional[bytes]:
+        with self.lock:
+            if k in self.items:
+                self.items.move_to_end(k); return self.items[k]
+        data=self.disk.get(k) if self.disk else None
+        if data is not None: self.put(k,data,disk=False)
+        return data
+
+    def put(self,k,data:bytes,disk:bool=True):
+        with self.lock:
+            if k in self.items: self.size-=len(self.items.pop(k))
+            self.items[k]=data; self.size+=len(data)
+            while len(self.items)>1 and self.size>self.max_bytes:
+                _,v=self.items.popitem(last=False); self.size-=len(v)
+        if disk and self.disk: self.disk.put(k,data)
+
+@st.cache_resource
+def preview_cache()->ByteLRU:
+    disk=DiskCache(os.path.join(CACHE_DIR,"previews"),PREVIEW_DISK_MB*1024*1024) \
+         if PREVIEW_DISK_MB>0 else None
+    return ByteLRU(PREVIEW_CACHE_MB*1024*1024,disk)
+
+def encode_pixmap(pix:fitz.Pixmap,fmt:str="png",q:int=PREVIEW_QUALITY)->bytes:
+    if fmt in("jpeg","jpg"): return pix.tobytes("jpg",jpg_quality=q)
+    if fmt=="webp":
+        try:
+            from PIL import Image
+            img=Image.frombuffer("RGB",(pix.width,pix.height),pix.samples_mv,
+                                 "raw","RGB",pix.stride,1)
+            buf=io.BytesIO(); img.save(buf,"WEBP",quality=q); return buf.getvalue()
+        except ImportError: return pix.tobytes("jpg",jpg_quality=q)
+    return pix.tobytes("png")
+
+# ═══════════════════════════════════════════════
+# PROCESS POOL  — page-parallel work, one document per worker
+# ═══════════════════════════════════════════════
+MAX_WORKERS=os.cpu_count() or 1
+
+def _spec_main():
+    # Streamlit runs this script as a bare, spec-less "__main__" module, which
+    # a spawn / forkserver child would re-execute (the whole app) on start-up.
+    # A "__main__" spec makes multiprocessing skip that: the workers only need
+    # pdf_workers, never this script.
+    m=sys.modules.get("__main__")
+    if m is not None and getattr(m,"__spec__",None) is None:
+        m.__spec__=importlib.machinery.ModuleSpec("__main__",None)
+
+@st.cache_resource
+def worker_pool()->ProcessPoolExecutor:
+    # One long-lived pool shared by all sessions. forkserver/spawn never fork
+    # the threaded server, and workers keep their open documents between jobs.
+    meth="forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    ctx=multiprocessing.get_context(meth)
+    if meth=="forkserver": ctx.set_forkserver_preload(["pdf_workers"])
+    _spec_main()
+    return ProcessPoolExecutor(max_workers=MAX_WORKERS,mp_context=ctx,
+                               initializer=pdf_workers.init_worker)
+
+def pool_map(fn,items,workers:int):
+    # Ordered map over the shared pool with at most `workers` tasks of this call
+    # in flight. fn must be a pdf_workers function, so workers import it by name.
+    _spec_main(); ex=worker_pool(); workers=max(1,min(workers,MAX_WORKERS))
+    it=iter(items); pending=deque()
+    try:
+        pending.extend(ex.submit(fn,x) for x in itertools.islice(it,workers))
+        while pending:
+            r=pending.popleft().result()
+            for x in itertools.islice(it,1): pending.append(ex.submit(fn,x))
+            yield r
+    except BrokenProcessPool:
+        worker_pool.clear(); raise   # a worker died: start a fresh pool next time
+    finally:
+        for f in pending: f.cancel()
+
 # ═══════════════════════════════════════════════
 # UTILITIES
 # ═══════════════════════════════════════════════
-def validate_pdf(f_or_b, max_mb=50)->Tuple[bool,str,int]:
+# Streamlit itself rejects larger uploads first: keep server.maxUploadSize in
+# .streamlit/config.toml at least this high
+MAX_UPLOAD_MB=int(os.environ.get("PDF_STUDIO_MAX_UPLOAD_MB","500"))
+SPOOL_TTL_H=24   # spool dirs of sessions idle this long are swept
+
+MAX_PAGES=int(os.environ.get("PDF_STUDIO_MAX_PAGES","5000"))
+
+_REF=rb"\s+(\d+)\s+(\d+)\s+R"
+
+def _last(rx:bytes,buf):
+    m=None
+    for m in re.finditer(rx,buf): pass
+    return m
+
+def _raw_obj(buf,n:int,g:int)->Optional[bytes]:
+    # raw text of the newest `n g obj` definition (uncompressed objects only)
+    tag=b"%d %d obj"%(n,g); i=len(buf)
+    while True:
+        i=buf.rfind(tag,0,i)
+        if i<0: return None
+        if i==0 or not buf[i-1:i].isdigit(): break
+    j=buf.find(b"endobj",i,i+65536)
+    return buf[i:j if j>0 else i+4096]
+
+def scan_pdf(buf)->Tuple[Optional[str],Optional[int]]:
+    # Header check plus page count read from the page tree root in the raw
+    # bytes — nothing is parsed or decompressed. Returns (error, pages); only a
+    # missing header is an error. pages is None whenever the trailer / xref look
+    # off or the root is out of reach (object stream, indirect /Count): the
+    # caller then lets MuPDF open — and if need be repair — the file instead.
+    n=len(buf); hdr=buf.find(b"%PDF-",0,1024)
+    if hdr<0: return "Missing %PDF header",None
+    tail=buf[max(0,n-2048):]
+    sx=_last(rb"startxref\s+(\d+)",tail)
+    if not sx or b"%%EOF" not in tail: return None,None
+    # junk before the header shifts every offset; writers disagree on whether
+    # offsets count from the file start or from %PDF, so accept either
+    for off in dict.fromkeys((int(sx[1])+hdr,int(sx[1]))):
+        head=buf[off:off+64]
+        if head.lstrip().startswith(b"xref") or re.match(rb"\s*\d+\s+\d+\s+obj",head): break
+    else: return None,None
+    # classic trailer sits in the tail; an xref stream carries /Root in its own dict
+    root=_last(rb"/Root"+_REF,tail) or _last(rb"/Root"+_REF,buf[off:off+4096])
+    cat=root and _raw_obj(buf,int(root[1]),int(root[2]))
+    pr=cat and re.search(rb"/Pages"+_REF,cat)
+    node=pr and _raw_obj(buf,int(pr[1]),int(pr[2]))
+    cnt=node and re.search(rb"/Count\s+(\d+)\b(?!\s+\d+\s+R)",node)
+    return None,(int(cnt[1]) if cnt else None)
+
+def validate_pdf(f_or_b, max_mb=MAX_UPLOAD_MB, max_pages=MAX_PAGES)->Tuple[bool,str,int]:
     try:
-        if isinstance(f_or_b,(bytes,bytearray)):
-            pb=f_or_b
+        if isinstance(f_or_b,str): sz=os.path.getsize(f_or_b)
+        elif isinstance(f_or_b,(bytes,bytearray)): sz=len(f_or_b)
+        else: f_or_b.seek(0,2); sz=f_or_b.tell(); f_or_b.seek(0)
+        if sz>max_mb*1024*1024: return False,f"Too large (max {max_mb}MB)",0
+        if sz==0: return False,"Empty file",0
+        if isinstance(f_or_b,str):
+            with open(f_or_b,"rb") as f, mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) as mm:
+                err,pg=scan_pdf(mm)
+            src=f_or_b
         else:
-            f_or_b.seek(0,2); sz=f_or_b.tell(); f_or_b.seek(0)
-            if sz>max_mb*1024*1024: return False,f"Too large (max {max_mb}MB)",0
-            pb=f_or_b.read(); f_or_b.seek(0)
-        doc=fitz.open(stream=pb,filetype="pdf"); pg=len(doc); doc.close()
+            src=f_or_b if isinstance(f_or_b,(bytes,bytearray)) else f_or_b.read()
+            if not isinstance(f_or_b,(bytes,bytearray)): f_or_b.seek(0)
+            src=bytes(src); err,pg=scan_pdf(src)
+        if err: return False,f"Invalid PDF: {err}",0
+        if pg is None:   # structure not readable raw: let MuPDF open it
+            with pdf_lock(src) as d: pg=len(d)
         if pg==0: return False,"No pages",0
+        if pg>max_pages: return False,f"Too many pages ({pg}, max {max_pages})",pg
         return True,f"Valid PDF ({pg} pages)",pg
     except Exception as e:
         return False,f"Invalid PDF: {e}",0
 
-def get_pdf_bytes(f)->Optional[bytes]:
-    try: f.seek(0); d=f.read(); f.seek(0); return d
-    except: return None
+def spool_dir()->str:
+    # per-session temp dir; also sweeps dirs left behind by ended sessions
+    d=st.session_state.get("spool_dir")
+    if not d or not os.path.isdir(d):
+        root=os.path.join(CACHE_DIR,"spool"); os.makedirs(root,exist_ok=True)
+        for e in os.scandir(root):
+            if e.is_dir() and time.time()-e.stat().st_mtime>SPOOL_TTL_H*3600:
+                shutil.rmtree(e.path,ignore_errors=True)
+        d=st.session_state.spool_dir=tempfile.mkdtemp(prefix="s_",dir=root)
+    os.utime(d)
+    return d
+
+def spool_bytes(pb:PdfSrc)->str:
+    if isinstance(pb,str): return pb
+    p=os.path.join(spool_dir(),hashlib.sha256(pb).hexdigest()+".pdf")
+    if not os.path.exists(p):
+        fd,tmp=tempfile.mkstemp(dir=os.path.dirname(p),suffix=".part")
+        with os.fdopen(fd,"wb") as f: f.write(pb)
+        os.replace(tmp,p)
+    return p
+
+def spool_upload(f)->Optional[str]:
+    # copy an upload to the session spool dir in 1 MB chunks, named by SHA-256;
+    # helpers then open it by filename instead of holding another bytes copy
+    try:
+        memo=st.session_state.setdefault("spooled",{}); fid=getattr(f,"file_id",None)
+        d=spool_dir()   # also keeps a live session's dir clear of the sweep
+        if fid in memo and os.path.exists(memo[fid]): return memo[fid]
+        h=hashlib.sha256(); fd,tmp=tempfile.mkstemp(dir=d,suffix=".part")
+        f.seek(0)
+        with os.fdopen(fd,"wb") as out:
+            for chunk in iter(lambda:f.read(1<<20),b""): h.update(chunk); out.write(chunk)
+        f.seek(0)
+        p=os.path.join(d,h.hexdigest()+".pdf"); os.replace(tmp,p)
+        if fid: memo[fid]=p
+        return p
+    except Exception as e:
+        logger.warning(f"spool failed: {e}"); return None
 
 def hex_to_rgb(h:str)->Tuple[float,float,float]:
-    h=h.lstrip('#'); return int(h[:2],16)/255,int(h[2:4],16)/255,int(h[4:6],16)/255
-
-def push_undo(pb:bytes):
-    st.session_state.undo_stack.append(pb)
-    if len(st.session_state.undo_stack)>5: st.session_state.undo_stack.pop(0)
-
-def pop_undo()->Optional[bytes]:
-    return st.session_state.undo_stack.pop() if st.session_state.undo_stack else None
-
-def download_btn(pb:bytes, fn:str="output.pdf", lbl:str=None):
-    sz=len(pb); lbl=lbl or f"⬇ Download ({sz/1024:.1f} KB)"
-    st.download_button(lbl,pb,fn,"application/pdf",use_container_width=True)
-
-def open_in_new_tab(pb:bytes, lbl:str="🔓 Open in Browser"):
-    b64=base64.b64encode(pb).decode()
+    h=h.lstrip('#')
+    if len(h)==3: h="".join(c*2 for c in h)
+    return int(h[:2],16)/255,int(h[2:4],16)/255,int(h[4:6],16)/255
+
+# Undo log: each entry is the operation applied to a state (name + params), not
+# a copy of the PDF. Full snapshots stay only where UNDO_BUDGET_MB allows —
+# always the oldest (replay base) and the newest kept — and any other state is
+# rebuilt by replaying ops forward from the nearest earlier snapshot.
+UNDO_MAX_STEPS=50
+UNDO_BUDGET_MB=int(os.environ.get("PDF_STUDIO_UNDO_MB","32"))   # per session
+UNDO_DISK_MB=int(os.environ.get("PDF_STUDIO_UNDO_DISK_MB","1024"))   # spooled snapshots, per session
+UNDO_OPS={"replace":       lambda pb,**k: smart_replace(pb,**k)[0],
+          "batch_replace": lambda pb,**k: batch_replace(pb,**k)[0]}
+
+def release_spool(p:Optional[PdfSrc]):
+    # delete a spooled edit state once no upload, viewer or undo entry refers to it
+    ss=st.session_state
+    if not isinstance(p,str) or os.path.dirname(p)!=ss.get("spool_dir"): return
+    if p==ss.get("viewer_pdf") or p in ss.get("spooled",{}).values() \
+       or any(e["snap"]==p for e in ss.get("undo_stack",[])): return
+    try: os.remove(p)
+    except OSError: pass
+
+def spool_lost()->bool:
+    # viewer / undo states whose spooled file is gone (swept after SPOOL_TTL_H idle)
+    ss=st.session_state
+    return any(isinstance(p,str) and not os.path.exists(p)
+               for p in [ss.get("viewer_pdf"),*(e["snap"] for e in ss.get("undo_stack",[]))])
+
+def _snap_size(snap,kind)->int:
+    if not isinstance(snap,kind): return 0
+    if kind is bytes: return len(snap)
+    try: return os.path.getsize(snap)
+    except OSError: return 0
+
+def undo_state(log:List[Dict],i:int)->PdfSrc:
+    j=i
+    while log[j]["snap"] is None: j-=1
+    pb=log[j]["snap"]
+    for e in log[j:i]: pb=UNDO_OPS[e["op"]](pb,**e["params"])
+    return pb
+
+def push_undo(pb:PdfSrc,op:str,params:Dict,label:str=""):
+    # record that `op(pb, **params)` is about to replace state pb
+    log=st.session_state.undo_stack
+    log.append({"op":op,"params":params,"label":label,"snap":pb})
+    while len(log)>UNDO_MAX_STEPS:
+        if log[1]["snap"] is None: log[1]["snap"]=undo_state(log,1)
+        release_spool(log.pop(0)["snap"])
+    # bytes snapshots count against the memory budget, spooled (path) ones
+    # against the disk budget; dropped spool files are deleted right away
+    for kind,cap in ((bytes,UNDO_BUDGET_MB),(str,UNDO_DISK_MB)):
+        size=sum(_snap_size(e["snap"],kind) for e in log)
+        for e in log[1:-1]:
+            if size<=cap*1024*1024: break
+            n=_snap_size(e["snap"],kind)
+            if n: size-=n; p,e["snap"]=e["snap"],None; release_spool(p)
+
+def pop_undo()->Optional[PdfSrc]:
+    log=st.session_state.undo_stack
+    if not log: return None
+    pb=undo_state(log,len(log)-1); log.pop()
+    return pb
+
+def download_btn(pb:PdfSrc, fn:str="output.pdf", lbl:str=None):
+    sz=src_size(pb); lbl=lbl or f"⬇ Download ({sz/1024:.1f} KB)"
+    st.download_button(lbl,src_bytes(pb),fn,"application/pdf",use_container_width=True)
+
+def open_in_new_tab(pb:PdfSrc, lbl:str="🔓 Open in Browser"):
+    b64=base64.b64encode(src_bytes(pb)).decode()
     st.components.v1.html(f"""<!DOCTYPE html><html><head>
 <style>
 *{{margin:0;padding:0;box-sizing:border-box;}}
@@ -683,43 +1181,259 @@ def whatsapp_share(msg="Raghu ke Pro PDF Studio se PDF edit ki! 🚀"):
     st.markdown(f'<a href="https://wa.me/?text={enc}" target="_blank" class="whatsapp-btn">📲 Share on WhatsApp</a>',
                 unsafe_allow_html=True)
 
-def render_preview(pb:bytes, pg:int=0, dpi:int=120)->bytes:
-    doc=fitz.open(stream=pb,filetype="pdf")
-    pix=doc[min(pg,len(doc)-1)].get_pixmap(dpi=dpi); doc.close()
-    return pix.tobytes("png")
-
-def pdf_info(doc,pb:bytes):
+@pdf_locked
+def render_preview(pb:PdfSrc, pg:int=0, dpi:int=120, fmt:str=PREVIEW_FMT)->bytes:
+    doc=open_pdf(pb); pg=min(pg,len(doc)-1)
+    k=(pdf_key(pb),pg,dpi,fmt); data=preview_cache().get(k)
+    if data is None:
+        data=encode_pixmap(doc[pg].get_pixmap(dpi=dpi),fmt)
+        preview_cache().put(k,data)
+    return data
+
+def show_hit_preview(pb:PdfSrc,hits:Dict[int,Dict],max_thumbs:int=12):
+    if not hits: st.warning("⚠️ Not found."); return
+    st.info(f"👁 {sum(h['count'] for h in hits.values())} hit(s) on {len(hits)} page(s) — nothing changed yet.")
+    st.dataframe(pd.DataFrame([{"Page":pn+1,"Hits":h["count"],
+                                "Boxes":", ".join(f"({r.x0:.0f},{r.y0:.0f},{r.x1:.0f},{r.y1:.0f})"
+                                                  for r in h["rects"][:6])}
+                               for pn,h in hits.items()]),
+                 use_container_width=True,hide_index=True)
+    cols=st.columns(4)
+    for i,(pn,h) in enumerate(list(hits.items())[:max_thumbs]):
+        cols[i%4].image(highlight_thumb(pb,pn,h["rects"]),
+                        caption=f"P{pn+1} · {h['count']} hit(s)",use_container_width=True)
+    if len(hits)>max_thumbs: st.caption(f"Thumbnails for the first {max_thumbs} pages with hits.")
+
+def pdf_info(doc,pb:PdfSrc):
     m=doc.metadata; c1,c2,c3,c4=st.columns(4)
     c1.metric("📄 Pages",len(doc))
     c2.metric("👤 Author",(m.get('author') or 'Unknown')[:16])
-    c3.metric("📦 Size",f"{len(pb)/1024:.1f} KB")
+    c3.metric("📦 Size",f"{src_size(pb)/1024:.1f} KB")
     c4.metric("🔒 Enc.","Yes" if doc.is_encrypted else "No")
 
 # ═══════════════════════════════════════════════
 # PDF OPERATIONS
 # ═══════════════════════════════════════════════
+# full: garbage=4 rewrite — compacts and de-duplicates every object
+# fast: garbage=1 — only drops orphaned objects (incl. the redacted content
+#       streams, so replaced text does not survive), no compaction/dedup pass
+# auto: fast when at most FAST_SAVE_MAX_PAGES pages changed, else full
+# (MuPDF refuses incremental saves once redactions are applied)
+SAVE_MODES=["auto","full","fast"]
+FAST_SAVE_MAX_PAGES=10
+
+def save_pdf(doc:fitz.Document,mode:str="full",touched:int=0)->bytes:
+    if mode=="auto": mode="fast" if touched<=FAST_SAVE_MAX_PAGES else "full"
+    out=io.BytesIO(); doc.save(out,garbage=4 if mode=="full" else 1,deflate=True)
+    return out.getvalue()
+
+def write_hits(page,hits:List[Tuple[fitz.Rect,str]],fn:str,size:float,tr,br):
+    # one redaction pass for every hit on the page, then the replacement text
+    for r,_ in hits: page.add_redact_annot(r,fill=br)
+    page.apply_redactions()
+    for r,repl in hits:
+        if not repl: continue
+        wr=fitz.Rect(r.x0,r.y0-2,
+                     r.x0+max(r.width,len(repl)*size*0.55),r.y1+2)
+        page.insert_textbox(wr,repl,fontname=fn,fontsize=size,
+                            color=tr,fill=br,align=fitz.TEXT_ALIGN_LEFT)
+
+# Page text with one bbox per character (from rawdict), built once per page and
+# matched against any number of patterns; lines are joined with "\n"
+class CharMap:
+    def __init__(self,page,tp:Optional[fitz.TextPage]=None):
+        chars=[]; self.boxes=[]; self.lines=[]; lid=0
+        raw=page.get_text("rawdict",textpage=tp) if tp else page.get_text("rawdict",flags=TEXT_FLAGS)
+        for b in raw["blocks"]:
+            if b.get("type")!=0: continue
+            for ln in b.get("lines",[]):
+                for sp in ln.get("spans",[]):
+                    for ch in sp.get("chars",[]):
+                        chars.append(ch["c"]); self.boxes.append(ch["bbox"]); self.lines.append(lid)
+                chars.append("\n"); self.boxes.append(None); self.lines.append(lid); lid+=1
+        self.text="".join(chars)
+
+    def rects(self,a:int,b:int)->List[fitz.Rect]:
+        # one rect per text line covered by text[a:b]
+        out={}
+        for i in range(a,b):
+            if self.boxes[i] is None: continue
+            r=fitz.Rect(self.boxes[i]); l=self.lines[i]
+            out[l]=out[l]|r if l in out else r
+        return list(out.values())
+
+    def folded(self,case:bool)->str:
+        # text for literal matching: same length as .text, line breaks as spaces
+        t=self.text.replace("\n"," ")
+        return t if case else fold(t)
+
+def fold(t:str)->str:
+    # lower-case without changing the length: chars whose lower case is longer stay
+    lo=t.lower()
+    return lo if len(lo)==len(t) else "".join(c if len(c.lower())!=1 else c.lower() for c in t)
+
+WORD_CHAR=re.compile(r"\w")   # whole-word boundary, same rule as compile_find
+
+def compile_find(find:str,case=True,regex=False,whole=False)->"re.Pattern":
+    pat=find if regex else r"\s+".join(re.escape(w) for w in find.split())
+    if whole: pat=rf"(?<!\w)(?:{pat})(?!\w)"
+    return re.compile(pat,0 if case else re.I)
+
+def match_hits(cm:CharMap,rx,repl:str,regex=False)->Tuple[List[Tuple[fitz.Rect,str]],int]:
+    # (rect, text) per covered line — the replacement goes on the first line only
+    hits=[]; n=0
+    for m in rx.finditer(cm.text):
+        if m.end()==m.start(): continue
+        t=m.expand(repl) if regex else repl; n+=1
+        hits+=[(r,t if i==0 else "") for i,r in enumerate(cm.rects(m.start(),m.end()))]
+    return hits,n
+
+@pdf_locked
 def smart_replace(pb,find,repl,font="Helvetica",size=12.0,
                   tc="#000",bgc="#fff",bold=False,italic=False,
-                  case=True)->Tuple[bytes,int]:
-    doc=fitz.open(stream=pb,filetype="pdf")
+                  case=True,save="auto",pages=None,regex=False,whole=False)->Tuple[bytes,int]:
+    # pages: 0-based page indices to edit in place (None = all pages)
+    # regex: find is a Python regex and repl may use \1 / \g<name>
+    rx=compile_find(find,case,regex,whole)
+    doc=load_pdf(pb)
     fn=get_font_name(font,bold,italic)
-    tr=hex_to_rgb(tc); br=hex_to_rgb(bgc); tot=0
-    for page in doc:
-        hits=page.search_for(find)
+    tr=hex_to_rgb(tc); br=hex_to_rgb(bgc); tot=0; touched=0
+    pns=range(len(doc)) if pages is None else sorted({p for p in pages if 0<=p<len(doc)})
+    for pn in pns:
+        # hits come from the shared text cache of the unmodified source — same
+        # bytes, same coordinates — and are then written on the private copy
+        hits,n=match_hits(page_parsed(pb,pn,"charmap"),rx,repl,regex)
+        if not n: continue
+        tot+=n; touched+=1
+        write_hits(doc[pn],hits,fn,size,tr,br)
+    nb=save_pdf(doc,save,touched) if tot else src_bytes(pb); doc.close()
+    return nb,tot
+
+# Aho–Corasick automaton: every occurrence of many literal patterns in one scan
+class AhoCorasick:
+    def __init__(self,pats:List[str]):
+        self.goto=[{}]; self.fail=[0]; self.out=[[]]
+        for i,p in enumerate(pats):
+            s=0
+            for ch in p:
+                if ch not in self.goto[s]:
+                    self.goto.append({}); self.fail.append(0); self.out.append([])
+                    self.goto[s][ch]=len(self.goto)-1
+                s=self.goto[s][ch]
+            self.out[s].append(i)
+        q=deque(self.goto[0].values())
+        while q:
+            s=q.popleft()
+            for ch,t in self.goto[s].items():
+                q.append(t); f=self.fail[s]
+                while f and ch not in self.goto[f]: f=self.fail[f]
+                self.fail[t]=self.goto[f].get(ch,0)
+                self.out[t]=self.out[t]+self.out[self.fail[t]]
+
+    def find(self,text:str):
+        # yields (end index, pattern index) for every match
+        s=0
+        for i,ch in enumerate(text):
+            while s and ch not in self.goto[s]: s=self.fail[s]
+            s=self.goto[s].get(ch,0)
+            for p in self.out[s]: yield i,p
+
+def parse_pairs(txt:str)->List[Tuple[str,str]]:
+    # "find => replace" or tab-separated, one pair per line
+    pairs=[]
+    for ln in txt.splitlines():
+        sep="=>" if "=>" in ln else "\t" if "\t" in ln else None
+        if not sep: continue
+        f,r=ln.split(sep,1)
+        if f.strip(): pairs.append((f.strip(),r.strip()))
+    return pairs
+
+def csv_pair_cols(cols)->Optional[List]:
+    # the find / replace columns of a pairs CSV, headers matched in any case
+    low={str(c).strip().lower():c for c in cols}
+    return [low["find"],low["replace"]] if "find" in low and "replace" in low else None
+
+@pdf_locked
+def batch_replace(pb,pairs:List[Tuple[str,str]],font="Helvetica",size=12.0,
+                  tc="#000",bgc="#fff",bold=False,italic=False,
+                  save="auto",pages=None,case=False,whole=False)->Tuple[bytes,Dict[str,int]]:
+    # All patterns are found per page in one Aho–Corasick sweep over the page's
+    # CharMap text; match offsets map straight to character boxes, so no
+    # per-pattern search_for. Each page gets a single apply_redactions.
+    pairs=[(f,r) for f,r in dict(pairs).items() if f]
+    pats=[f if case else fold(f) for f,_ in pairs]; ac=AhoCorasick(pats)
+    doc=load_pdf(pb)
+    fn=get_font_name(font,bold,italic)
+    tr=hex_to_rgb(tc); br=hex_to_rgb(bgc); counts={f:0 for f,_ in pairs}; touched=0
+    pns=range(len(doc)) if pages is None else sorted({p for p in pages if 0<=p<len(doc)})
+    for pn in pns:
+        cm=page_parsed(pb,pn,"charmap"); text=cm.folded(case)
+        ms=[(e-len(pats[i])+1,e+1,i) for e,i in ac.find(text)]
+        if whole:
+            ms=[(a,b,i) for a,b,i in ms if not (a>0 and WORD_CHAR.match(text[a-1]) or
+                                                b<len(text) and WORD_CHAR.match(text[b]))]
+        taken=[False]*len(text); hits=[]
+        for a,b,i in sorted(ms,key=lambda m:(m[0]-m[1],m[0])):   # longest first
+            if any(taken[a:b]): continue
+            taken[a:b]=[True]*(b-a); f,repl=pairs[i]; counts[f]+=1
+            hits+=[(r,repl if k==0 else "") for k,r in enumerate(cm.rects(a,b))]
         if not hits: continue
-        tot+=len(hits); saved=list(hits)
-        for r in saved: page.add_redact_annot(r,fill=br)
-        page.apply_redactions()
-        for r in saved:
-            wr=fitz.Rect(r.x0,r.y0-2,
-                         r.x0+max(r.width,len(repl)*size*0.55),r.y1+2)
-            page.insert_textbox(wr,repl,fontname=fn,fontsize=size,
-                                color=tr,fill=br,align=fitz.TEXT_ALIGN_LEFT)
-    out=io.BytesIO(); doc.save(out,garbage=4,deflate=True); doc.close()
-    return out.getvalue(),tot
-
-def split_range(pb:bytes,ranges:str)->Dict[str,bytes]:
-    doc=fitz.open(stream=pb,filetype="pdf"); tot=len(doc); res={}
+        touched+=1; write_hits(doc[pn],hits,fn,size,tr,br)
+    nb=save_pdf(doc,save,touched) if touched else src_bytes(pb); doc.close()
+    return nb,counts
+
+@pdf_locked
+def find_hits(pb:PdfSrc,find:str,case=True,regex=False,whole=False,
+              pages=None)->Dict[int,Dict]:
+    # dry run on the shared read-only doc: {page_idx: {"count", "rects"}}
+    rx=compile_find(find,case,regex,whole); doc=open_pdf(pb); res={}
+    pns=range(len(doc)) if pages is None else sorted({p for p in pages if 0<=p<len(doc)})
+    for pn in pns:
+        hits,n=match_hits(page_parsed(pb,pn,"charmap"),rx,"")
+        if n: res[pn]={"count":n,"rects":[r for r,_ in hits]}
+    return res
+
+@pdf_locked
+def highlight_thumb(pb:PdfSrc,pn:int,rects:List[fitz.Rect],dpi:int=50)->bytes:
+    # low-dpi render with hits painted over in PIL — the document is untouched
+    from PIL import Image, ImageDraw
+    page=open_pdf(pb)[pn]; pix=page.get_pixmap(dpi=dpi)
+    img=Image.frombytes("RGB",(pix.width,pix.height),pix.samples)
+    ov=Image.new("RGBA",img.size,(0,0,0,0)); dr=ImageDraw.Draw(ov)
+    m=page.rotation_matrix*fitz.Matrix(dpi/72,dpi/72)
+    for r in rects:
+        q=(r*m).normalize()
+        dr.rectangle([q.x0-1,q.y0-1,q.x1+1,q.y1+1],fill=(255,213,79,120),
+                     outline=(234,88,12,255),width=2)
+    img=Image.alpha_composite(img.convert("RGBA"),ov).convert("RGB")
+    buf=io.BytesIO(); img.save(buf,"JPEG",quality=80); return buf.getvalue()
+
+def bench_save_modes(pb:PdfSrc,find:str,repl:str)->pd.DataFrame:
+    rows=[]
+    for m in SAVE_MODES[1:]:
+        t=time.perf_counter(); nb,cnt=smart_replace(pb,find,repl,save=m)
+        rows.append({"Mode":m,"Hits":cnt,
+                     "Time (ms)":round((time.perf_counter()-t)*1000,1),
+                     "Size (KB)":round(len(nb)/1024,1),
+                     "Δ Size":f"{(len(nb)-src_size(pb))/max(1,src_size(pb))*100:+.1f}%"})
+    return pd.DataFrame(rows)
+
+def parse_pages(spec:str,total:int)->List[int]:
+    # "1, 3, 5-7" → [0,2,4,5,6] (0-based, in order, no repeats, clamped to the
+    # document); blank or "all" selects every page, junk tokens are skipped
+    spec=(spec or "").strip().lower()
+    if spec in ("","all"): return list(range(total))
+    out={}
+    for p in spec.split(','):
+        m=re.fullmatch(r"\s*(\d+)\s*(?:-\s*(\d*)\s*)?",p)
+        if not m: continue
+        a=int(m[1]); b=a if m[2] is None else (int(m[2]) if m[2] else total)
+        for i in range(max(1,min(a,b)),min(total,max(a,b))+1): out[i-1]=None
+    return list(out)
+
+@pdf_locked
+def split_range(pb:PdfSrc,ranges:str)->Dict[str,bytes]:
+    doc=open_pdf(pb); tot=len(doc); res={}
     for p in ranges.split(','):
         p=p.strip()
         if not p: continue
@@ -729,58 +1443,304 @@ def split_range(pb:bytes,ranges:str)->Dict[str,bytes]:
         nd=fitz.open(); nd.insert_pdf(doc,from_page=s,to_page=e)
         buf=io.BytesIO(); nd.save(buf,garbage=4,deflate=True); nd.close()
         res[f"pages_{s+1}_to_{e+1}.pdf"]=buf.getvalue()
-    doc.close(); return res
+    return res
 
-def merge_pdfs(pbs:List[bytes])->bytes:
+def merge_pdfs(pbs:List[PdfSrc])->bytes:
     m=fitz.open()
     for pb in pbs:
-        s=fitz.open(stream=pb,filetype="pdf"); m.insert_pdf(s); s.close()
+        with pdf_lock(pb) as d: m.insert_pdf(d)
     out=io.BytesIO(); m.save(out,garbage=4,deflate=True); m.close()
     return out.getvalue()
 
-def extract_images(pb:bytes)->List[Dict]:
-    doc=fitz.open(stream=pb,filetype="pdf"); imgs=[]
+@pdf_locked
+def iter_images(pb:PdfSrc):
+    # Yields one entry per distinct image as soon as it is decoded: an xref is
+    # decoded once however many pages use it, and different xrefs with identical
+    # data (re-embedded logos) collapse by content hash. "uses" lists every
+    # page/placement and keeps growing until the generator is exhausted.
+    doc=open_pdf(pb); imgs=[]; by_x={}; by_h={}
     for pn,page in enumerate(doc):
-        for ii,info in enumerate(page.get_images(full=True)):
-            try:
-                bi=doc.extract_image(info[0])
-                imgs.append({"page":pn+1,"index":ii+1,"ext":bi["ext"],
-                             "data":bi["image"],"width":bi.get("width",0),
-                             "height":bi.get("height",0)})
-            except: pass
-    doc.close(); return imgs
-
-def extract_text(pb:bytes,mode="plain")->Dict[int,str]:
-    doc=fitz.open(stream=pb,filetype="pdf"); res={}
-    for pn,page in enumerate(doc):
-        if mode=="html": res[pn+1]=page.get_text("html")
-        elif mode=="blocks": res[pn+1]="\n".join(b[4] for b in page.get_text("blocks"))
-        else: res[pn+1]=page.get_text()
-    doc.close(); return res
+        seen=set()
+        for info in page.get_images(full=True):
+            x=info[0]
+            if (x,info[7]) in seen: continue
+            seen.add((x,info[7]))
+            if x not in by_x:
+                try: bi=doc.extract_image(x)
+                except: bi=None
+                if not bi: by_x[x]=None; continue
+                h=hashlib.sha256(bi["image"]).hexdigest()
+                new=h not in by_h
+                if new:
+                    by_h[h]=len(imgs); n=len(imgs)+1
+                    imgs.append({"id":n,"page":pn+1,"ext":bi["ext"],"data":bi["image"],
+                                 "width":bi.get("width",0),"height":bi.get("height",0),
+                                 "hash":h,"xrefs":[],"uses":[],
+                                 "name":f"img{n:04d}_p{pn+1}.{bi['ext']}"})
+                imgs[by_h[h]]["xrefs"].append(x); by_x[x]=by_h[h]; del bi
+                if new: yield imgs[-1]
+            if by_x[x] is None: continue
+            img=imgs[by_x[x]]
+            # get_image_bbox reads the placement off the content stream;
+            # get_image_rects would decode the whole image again to hash it
+            try: r=page.get_image_bbox(info)
+            except: r=None
+            if r is not None and (r.is_infinite or r.is_empty): r=None
+            img["uses"].append({"page":pn+1,"xref":x,"name":info[7],
+                                "bbox":[round(v,2) for v in r] if r else None})
+
+def extract_images(pb:PdfSrc)->List[Dict]:
+    return list(iter_images(pb))
+
+def image_manifest(imgs:List[Dict])->str:
+    return json.dumps([{k:img[k] for k in ("name","width","height","hash","xrefs","uses")}
+                       for img in imgs],indent=1)
+
+# formats whose data is already compressed — deflating them again is wasted CPU
+PRECOMPRESSED={"jpg","jpeg","jpx","jp2","png","jb2","jbig2","webp","gif"}
+ZIP_SPOOL_MB=32   # archive stays in RAM up to this size, then rolls over to disk
+
+THUMB_PX=240        # longest side of gallery thumbnails
+THUMB_WORKERS=4
+
+def jpeg_bytes(img,px:int)->bytes:
+    img.thumbnail((px,px))
+    if img.mode not in ("RGB","L"): img=img.convert("RGB")
+    buf=io.BytesIO(); img.save(buf,"JPEG",quality=75); return buf.getvalue()
+
+def make_thumb(data:bytes,px:int=THUMB_PX)->Optional[bytes]:
+    # JPEG thumbnail, PIL only (safe on the thumb threads): draft() lets the JPEG
+    # decoder skip to a 1/2–1/8 scale and reduce() bins the rest cheaply
+    from PIL import Image
+    try:
+        img=Image.open(io.BytesIO(data)); img.draft("RGB",(px,px))
+        f=max(img.size)//(2*px)
+        if f>1: img=img.reduce(f)
+        return jpeg_bytes(img,px)
+    except Exception: return None
+
+def mupdf_thumb(data:bytes,px:int=THUMB_PX)->Optional[bytes]:
+    # formats PIL can't read (JPX, JBIG2, …) — MuPDF isn't thread-safe, so this
+    # only ever runs on the calling thread
+    from PIL import Image
+    try:
+        pix=fitz.Pixmap(data)
+        while max(pix.width,pix.height)>2*px: pix.shrink(1)
+        if pix.alpha or pix.n>3: pix=fitz.Pixmap(fitz.csRGB,pix,0)
+        return jpeg_bytes(Image.frombytes("RGB" if pix.n==3 else "L",(pix.width,pix.height),pix.samples),px)
+    except Exception: return None
+
+def images_zip(pb:PdfSrc,px:int=THUMB_PX):
+    # Streams each distinct image into the archive as soon as it is decoded and
+    # thumbnails it on a thread pool; the full data is then dropped, so only the
+    # archive and small thumbs (also cached by content hash) outlive the call.
+    # Returns (spooled archive file rewound to 0, image entries with "thumb").
+    out=tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MB*1024*1024,dir=spool_dir())
+    cache=preview_cache(); imgs=[]; pend=deque()
+    def done(img,fut,data):
+        tb=fut.result() if fut else cache.get(("thumb",img["hash"],px))
+        if fut and tb is None: tb=mupdf_thumb(data,px)   # PIL gave up: decode here
+        if fut and tb: cache.put(("thumb",img["hash"],px),tb,disk=False)
+        img["thumb"]=tb
+    with zipfile.ZipFile(out,"w",zipfile.ZIP_DEFLATED) as zf, \
+         ThreadPoolExecutor(THUMB_WORKERS) as ex:
+        for img in iter_images(pb):
+            zf.writestr(img["name"],img["data"],
+                        compress_type=zipfile.ZIP_STORED if img["ext"] in PRECOMPRESSED else zipfile.ZIP_DEFLATED)
+            hit=cache.get(("thumb",img["hash"],px)) is not None
+            data=img["data"]; img["data"]=None; imgs.append(img)
+            pend.append((img,None,None) if hit else (img,ex.submit(make_thumb,data,px),data))
+            del data
+            # bound the backlog so queued jobs don't pin many full images at once
+            while len(pend)>2*THUMB_WORKERS: done(*pend.popleft())
+        while pend: done(*pend.popleft())
+        zf.writestr("manifest.json",image_manifest(imgs))
+    out.seek(0)
+    return out,imgs
+
+TEXT_CHUNK=16   # pages per process-pool task
+
+@pdf_locked
+def extract_text(pb:PdfSrc,mode="plain",pages:Optional[List[int]]=None,workers:int=1):
+    # lazy: yields (page number, text) for the selected 0-based pages only.
+    # With workers>1 the selection is cut into TEXT_CHUNK-page tasks that each
+    # worker runs against its own handle on the spooled file; results come back
+    # in page order with at most `workers` chunks in flight.
+    doc=open_pdf(pb); sel=list(range(len(doc))) if pages is None else pages
+    if workers<=1 or len(sel)<2*TEXT_CHUNK:
+        for pn in sel:
+            if mode=="html": yield pn+1,page_text(doc[pn],mode)
+            else: page,tp=text_page(pb,pn); yield pn+1,page_text(page,mode,tp)
+        return
+    src=spool_bytes(pb)
+    chunks=[(src,sel[i:i+TEXT_CHUNK],mode) for i in range(0,len(sel),TEXT_CHUNK)]
+    for res in pool_map(pdf_workers.text_task,chunks,workers):
+        yield from res
+
+def bench_text(pb:PdfSrc,mode:str,pages:List[int],workers:int)->pd.DataFrame:
+    # serial run against a cold page cache vs. the pool; below 2*TEXT_CHUNK
+    # pages extract_text never uses the pool, so there is nothing to compare
+    if workers>1 and len(pages)<2*TEXT_CHUNK:
+        raise ValueError(f"Select at least {2*TEXT_CHUNK} pages to benchmark the worker pool.")
+    rows=[]; dts=[]
+    for w in sorted({1,workers}):
+        if w==1: page_cache().drop_doc(pdf_key(pb))
+        t=time.perf_counter(); n=sum(1 for _ in extract_text(pb,mode,pages,w))
+        dt=time.perf_counter()-t; dts.append(dt)
+        rows.append({"Workers":w,"Pages":n,"Time (s)":round(dt,3),
+                     "Pages/s":round(n/max(dt,1e-9),1),
+                     "Speedup":f"{dts[0]/max(dt,1e-9):.2f}×"})
+    return pd.DataFrame(rows)
+
+TABLE_STRATEGIES=["lines","lines_strict","text"]
+TABLE_CACHE_MB=int(os.environ.get("PDF_STUDIO_TABLE_CACHE_MB","64"))
+
+@st.cache_resource
+def table_cache()->DiskCache:
+    return DiskCache(os.path.join(CACHE_DIR,"tables"),TABLE_CACHE_MB*1024*1024)
+
+TABLE_MIN_SCORE=0.3   # default prefilter threshold; 0 runs find_tables everywhere
+RULE_MIN_LEN=8        # pt — shorter strokes are glyph decoration, not rulings
+
+def table_score(page:fitz.Page,tp:Optional[fitz.TextPage]=None,strategy:str="lines")->float:
+    # 0..1 likelihood that find_tables finds something, without running it.
+    # Ruling: distinct horizontal / vertical rule positions among the vector
+    # strokes (a grid needs ≥2 of each). Alignment ("text" strategy only): rows
+    # split into cells at gaps wider than the text height, and how many cell
+    # starts line up in x-columns shared by ≥3 such rows.
+    segs=[]; pr=page.rect
+    for d in page.get_cdrawings():
+        for it in d["items"]:
+            if it[0]=="l": segs.append((*it[1],*it[2]))
+            elif it[0]=="re":
+                x0,y0,x1,y1=it[1]
+                if x1-x0>0.9*pr.width and y1-y0>0.9*pr.height: continue   # page background
+                segs+=[(x0,y0,x1,y0),(x0,y1,x1,y1),(x0,y0,x0,y1),(x1,y0,x1,y1)]
+    ruling=0.0
+    if segs:
+        a=np.asarray(segs,float); dx=np.abs(a[:,2]-a[:,0]); dy=np.abs(a[:,3]-a[:,1])
+        hy=np.unique(np.round(a[(dy<1)&(dx>=RULE_MIN_LEN),1]/2))
+        vx=np.unique(np.round(a[(dx<1)&(dy>=RULE_MIN_LEN),0]/2))
+        if len(hy)>=2 and len(vx)>=2: ruling=min(1,(len(hy)-1)/3)*min(1,(len(vx)-1)/2)
+    if strategy!="text" or ruling>=1: return ruling
+    w=page.get_text("words",textpage=tp) if tp else page.get_text("words")
+    if len(w)<9: return ruling
+    a=np.array([r[:4] for r in w],float)
+    ht=max(1.0,float(np.median(a[:,3]-a[:,1])))
+    row=np.round(a[:,3]/(ht/2)).astype(int)
+    o=np.lexsort((a[:,0],row)); a=a[o]; row=row[o]
+    new=np.ones(len(a),bool); new[1:]=(row[1:]!=row[:-1])|(a[1:,0]-a[:-1,2]>ht)
+    crow=row[new]; cx=np.round(a[new,0]/3).astype(int)            # cell starts
+    rows,cnt=np.unique(crow,return_counts=True); trows=rows[cnt>=3]  # rows of 3+ cells
+    if len(trows)<3: return ruling
+    m=np.isin(crow,trows); pairs=np.unique(np.stack([cx[m],crow[m]],1),axis=0)
+    xs,nr=np.unique(pairs[:,0],return_counts=True); cols=xs[nr>=3]
+    if len(cols)<2: return ruling
+    align=float(np.isin(cx[m],cols).mean())*min(1,len(trows)/4)
+    return max(ruling,align)
+
+def rows_to_df(rows:List[List])->pd.DataFrame:
+    df=pd.DataFrame(rows); df.columns=df.iloc[0]
+    return df[1:].reset_index(drop=True)
+
+@pdf_locked
+def iter_tables(pb:PdfSrc,pages:Optional[List[int]]=None,strategy="lines",workers=1,
+                min_score:float=0.0):
+    # yields (page_no, [DataFrame…]) in selection order as each page is done;
+    # detections are cached per (doc, page, strategy), so only pages never
+    # seen with these settings reach find_tables (in the pool if workers>1).
+    # Uncached pages scoring below min_score are skipped and yield None.
+    doc=open_pdf(pb); cache=table_cache(); dk=pdf_key(pb)
+    sel=list(range(len(doc))) if pages is None else pages
+    keys={pn:(dk,pn,strategy) for pn in sel}
+    todo=[pn for pn in sel if not cache.has(keys[pn])]
+    skip=set()
+    if min_score>0:
+        # only the text strategy reads words; the lines strategies need no TextPage
+        score=(lambda pn:table_score(*text_page(pb,pn),strategy)) if strategy=="text" else \
+              (lambda pn:table_score(doc[pn],None,strategy))
+        skip={pn for pn in todo if score(pn)<min_score}
+        todo=[pn for pn in todo if pn not in skip]
+    if workers<=1 or len(todo)<2:
+        fresh=(page_tables(page_cache().entry(pb,pn)["page"],strategy) for pn in todo)
+    else:
+        src=spool_bytes(pb)
+        fresh=pool_map(pdf_workers.table_task,((src,pn,strategy) for pn in todo),
+                       min(workers,len(todo)))
+    todo=set(todo)
+    for pn in sel:
+        if pn in skip: yield pn+1,None; continue
+        hit=None if pn in todo else cache.get(keys[pn])
+        raw=json_loads(hit)
+        if raw is None:
+            raw=next(fresh) if pn in todo else page_tables(page_cache().entry(pb,pn)["page"],strategy)
+            cache.put(keys[pn],json.dumps(raw).encode())
+        yield pn+1,[rows_to_df(r) for r in raw]
+
+def extract_tables(pb:PdfSrc,pages=None,strategy="lines",workers=1,
+                   min_score:float=0.0)->Dict[int,List[pd.DataFrame]]:
+    return {pn:dfs for pn,dfs in iter_tables(pb,pages,strategy,workers,min_score) if dfs}
+
+# ── table export: streamed into spooled files, never a whole workbook in RAM ──
+TABLE_FORMATS={"Excel (.xlsx)":"xlsx","CSV (ZIP)":"csv","Parquet (ZIP)":"parquet"}
+TABLE_BROWSE=5   # tables per browser page
+
+def parquet_ok()->bool:
+    try: import pyarrow; return True
+    except ImportError: return False
+
+def sheet_name(name:str,used:set)->str:
+    # Excel: ≤31 chars, none of []:*?/\ , not blank, unique case-insensitively
+    base=(re.sub(r"[\[\]:*?/\\]","_",name).strip("'") or "Sheet")[:31]; n=base; k=1
+    while n.lower() in used: k+=1; n=f"{base[:31-len(str(k))-1]}~{k}"
+    used.add(n.lower()); return n
+
+def col_names(df:pd.DataFrame,blank:str="")->List[str]:
+    # detected header cells may be None (stored as NaN); repeats get a suffix
+    cols=[blank.format(j+1) if c is None or (isinstance(c,float) and pd.isna(c)) or c=="" else str(c)
+          for j,c in enumerate(df.columns)]
+    return [c if not c or cols.index(c)==j else f"{c}_{j+1}" for j,c in enumerate(cols)]
+
+def iter_table_list(all_t:Dict[int,List[pd.DataFrame]]):
+    for pn,dfs in all_t.items():
+        for i,df in enumerate(dfs): yield f"P{pn}_T{i+1}",df
+
+def tables_xlsx(all_t:Dict[int,List[pd.DataFrame]]):
+    # openpyxl write-only: rows stream to per-sheet temp files as they're appended
+    from openpyxl import Workbook
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    clean=lambda v: ILLEGAL_CHARACTERS_RE.sub("",v) if isinstance(v,str) else v
+    wb=Workbook(write_only=True); used=set()
+    for name,df in iter_table_list(all_t):
+        ws=wb.create_sheet(sheet_name(name,used))
+        ws.append([clean(c) or None for c in col_names(df)])
+        for row in df.itertuples(index=False,name=None): ws.append([clean(v) for v in row])
+    out=tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MB*1024*1024,dir=spool_dir())
+    wb.save(out); out.seek(0); return out
+
+def tables_zip(all_t:Dict[int,List[pd.DataFrame]],fmt:str="csv"):
+    # one member per table, each written straight into the archive stream
+    out=tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MB*1024*1024,dir=spool_dir())
+    with zipfile.ZipFile(out,"w",zipfile.ZIP_DEFLATED) as zf:
+        for name,df in iter_table_list(all_t):
+            with zf.open(f"{name}.{fmt}","w") as f:
+                if fmt=="parquet":
+                    df.set_axis(col_names(df,"col{}"),axis=1).astype("string").to_parquet(f,index=False)
+                else:
+                    with io.TextIOWrapper(f,encoding="utf-8",newline="") as tw: df.to_csv(tw,index=False)
+    out.seek(0); return out
 
-def extract_tables(pb:bytes)->Dict[int,List[pd.DataFrame]]:
-    doc=fitz.open(stream=pb,filetype="pdf"); all_t={}
-    for pn,page in enumerate(doc):
-        try:
-            dfs=[]
-            for tab in page.find_tables():
-                df=pd.DataFrame(tab.extract())
-                if not df.empty:
-                    df.columns=df.iloc[0]; df=df[1:].reset_index(drop=True); dfs.append(df)
-            if dfs: all_t[pn+1]=dfs
-        except: pass
-    doc.close(); return all_t
-
-def reorder_pages(pb:bytes,order:List[int])->bytes:
-    doc=fitz.open(stream=pb,filetype="pdf"); nd=fitz.open()
+@pdf_locked
+def reorder_pages(pb:PdfSrc,order:List[int])->bytes:
+    doc=open_pdf(pb); nd=fitz.open()
     for p in order:
         idx=p-1
         if 0<=idx<len(doc): nd.insert_pdf(doc,from_page=idx,to_page=idx)
     out=io.BytesIO(); nd.save(out,garbage=4,deflate=True)
-    nd.close(); doc.close(); return out.getvalue()
+    nd.close(); return out.getvalue()
 
 def add_text_sig(pb,txt,pg=1,x=400,y=750,sz=14,col="#1a237e")->bytes:
-    doc=fitz.open(stream=pb,filetype="pdf")
+    doc=load_pdf(pb)
     page=doc[min(pg-1,len(doc)-1)]; rgb=hex_to_rgb(col)
     rect=fitz.Rect(x-5,y-sz-4,x+len(txt)*sz*0.55+5,y+4)
     page.draw_rect(rect,color=rgb,width=1)
@@ -789,26 +1749,23 @@ def add_text_sig(pb,txt,pg=1,x=400,y=750,sz=14,col="#1a237e")->bytes:
     return out.getvalue()
 
 def add_img_sig(pb,imgb,pg=1,x=350,y=700,w=150,h=60)->bytes:
-    doc=fitz.open(stream=pb,filetype="pdf")
+    doc=load_pdf(pb)
     doc[min(pg-1,len(doc)-1)].insert_image(fitz.Rect(x,y,x+w,y+h),stream=imgb)
     out=io.BytesIO(); doc.save(out,garbage=4,deflate=True); doc.close()
     return out.getvalue()
 
 def add_text_wm(pb,txt="CONFIDENTIAL",op=0.15,col="#FF0000",
                 sz=60,ang=45,pgs="all")->bytes:
-    doc=fitz.open(stream=pb,filetype="pdf"); rgb=hex_to_rgb(col)
-    idxs=list(range(len(doc))) if pgs=="all" else \
-         [int(p)-1 for p in pgs.split(',') if p.strip().isdigit()]
-    for i in idxs:
-        if 0<=i<len(doc):
-            page=doc[i]; w,h=page.rect.width,page.rect.height
-            page.insert_text((w*0.1,h*0.55),txt,fontsize=sz,
-                             color=(*rgb,op),rotate=ang,overlay=True)
+    doc=load_pdf(pb); rgb=hex_to_rgb(col)
+    for i in parse_pages(pgs,len(doc)):
+        page=doc[i]; w,h=page.rect.width,page.rect.height
+        page.insert_text((w*0.1,h*0.55),txt,fontsize=sz,
+                         color=(*rgb,op),rotate=ang,overlay=True)
     out=io.BytesIO(); doc.save(out,garbage=4,deflate=True); doc.close()
     return out.getvalue()
 
 def add_img_wm(pb,imgb,op=0.2)->bytes:
-    doc=fitz.open(stream=pb,filetype="pdf")
+    doc=load_pdf(pb)
     for page in doc:
         r=page.rect
         page.insert_image(fitz.Rect(r.width*0.25,r.height*0.35,
@@ -823,25 +1780,96 @@ def check_ocr()->bool:
         except: st.session_state.ocr_available=False
     return st.session_state.ocr_available
 
-def run_ocr(pb:bytes,lang="eng",dpi=200)->Dict[int,Dict]:
-    import pytesseract; from PIL import Image
-    doc=fitz.open(stream=pb,filetype="pdf"); res={}
-    for pn,page in enumerate(doc):
-        pix=page.get_pixmap(dpi=dpi)
-        img=Image.open(io.BytesIO(pix.tobytes("png")))
-        txt=pytesseract.image_to_string(img,lang=lang)
-        cd=pytesseract.image_to_data(img,lang=lang,output_type=pytesseract.Output.DICT)
-        confs=[c for c in cd['conf'] if isinstance(c,(int,float)) and c>0]
-        res[pn+1]={"text":txt,"word_count":len([w for w in txt.split() if w.strip()]),
-                   "confidence":round(sum(confs)/max(1,len(confs)),1)}
-    doc.close(); return res
-
-def inspect_page(pb:bytes,pg:int=0)->Dict:
-    doc=fitz.open(stream=pb,filetype="pdf")
-    page=doc[min(pg,len(doc)-1)]
+HYBRID_MIN_CHARS=50     # text-layer chars below which a page counts as image-only
+HYBRID_MIN_COVER=0.25   # ...but only if images cover at least this page fraction
+
+def page_needs_ocr(page)->Tuple[bool,int,float]:
+    chars=len("".join(page.get_text().split()))
+    area=abs(page.rect) or 1; cover=0.0
+    if chars<HYBRID_MIN_CHARS:
+        for info in page.get_images(full=True):
+            # placement straight off the content stream — get_image_rects would
+            # decode and hash the whole image
+            try: r=page.get_image_bbox(info)
+            except Exception: continue
+            if not (r.is_infinite or r.is_empty): cover+=abs(r&page.rect)
+        cover=min(1.0,cover/area)
+    return chars<HYBRID_MIN_CHARS and cover>=HYBRID_MIN_COVER,chars,round(cover,2)
+
+def text_layer_page(page,dpi=200)->Dict:
+    # same shape as ocr_page, read from the PDF text layer (boxes in dpi pixels)
+    z=dpi/72
+    words=pd.DataFrame([{"block":b,"par":0,"line":ln,"word":wn,
+                         "left":round(x0*z),"top":round(y0*z),
+                         "width":round((x1-x0)*z),"height":round((y1-y0)*z),
+                         "conf":100.0,"text":t}
+                        for x0,y0,x1,y1,t,b,ln,wn in page.get_text("words")],
+                       columns=OCR_WORD_COLS)
+    return {"text":page.get_text(),"word_count":len(words),"confidence":100.0,
+            "words":words,"path":"text"}
+
+OCR_CACHE_MB=int(os.environ.get("PDF_STUDIO_OCR_CACHE_MB","512"))
+
+@st.cache_resource
+def ocr_cache()->DiskCache:
+    return DiskCache(os.path.join(CACHE_DIR,"ocr"),OCR_CACHE_MB*1024*1024)
+
+# cached as JSON, never pickle: the cache dir is a file store, not trusted code
+def ocr_dumps(r:Dict)->bytes:
+    w=r["words"].to_dict("split")
+    return json.dumps({**r,"words":{"columns":w["columns"],"data":w["data"]}}).encode()
+
+def ocr_loads(data:Optional[bytes])->Optional[Dict]:
+    r=json_loads(data)
+    try: r["words"]=pd.DataFrame(r["words"]["data"],columns=r["words"]["columns"]); return r
+    except Exception: return None
+
+@pdf_locked
+def iter_ocr(pb:PdfSrc,lang="eng",dpi=200,workers=1,hybrid=False):
+    # yields (page_no, result) in page order as soon as each page is done;
+    # pages already in the OCR cache for this (doc, lang, dpi) skip tesseract,
+    # and in hybrid mode pages with a usable text layer never reach it. Pages
+    # are checked lazily, only as far ahead as the pool needs work, so results
+    # stream from the first page on; cached pages skip the check.
+    doc=open_pdf(pb); n=len(doc); cache=ocr_cache(); dk=pdf_key(pb)
+    keys=[(dk,pn,lang,dpi) for pn in range(n)]
+    plan={}; jobs=deque(); queued=set(); pages=iter(range(n)); pool=workers>1
+    def step()->bool:
+        pn=next(pages,None)
+        if pn is None: return False
+        if cache.has(keys[pn]): plan[pn]=(True,None,None)
+        else:
+            plan[pn]=page_needs_ocr(doc[pn]) if hybrid else (True,None,None)
+            if pool and plan[pn][0]: jobs.append(pn); queued.add(pn)
+        return True
+    def feed():
+        while jobs or step():
+            if jobs: yield jobs.popleft()
+    if pool:
+        src=spool_bytes(pb)
+        fresh=pool_map(pdf_workers.ocr_task,((src,pn,lang,dpi) for pn in feed()),workers)
+    for pn in range(n):
+        while pn not in plan: step()
+        need,chars,cover=plan.pop(pn)
+        if not need: r=text_layer_page(doc[pn],dpi)
+        else:
+            r=None if pn in queued else ocr_loads(cache.get(keys[pn]))
+            if r is None:
+                r=next(fresh)[1] if pn in queued else ocr_page(doc[pn],lang,dpi)
+                cache.put(keys[pn],ocr_dumps(r))
+        if hybrid: r.update(text_chars=chars,img_cover=cover)
+        yield pn+1,r
+
+def run_ocr(pb:PdfSrc,lang="eng",dpi=200,workers=1,hybrid=False)->Dict[int,Dict]:
+    return dict(iter_ocr(pb,lang,dpi,workers,hybrid))
+
+@pdf_locked
+def inspect_page(pb:PdfSrc,pg:int=0)->Dict:
+    pg=min(pg,len(open_pdf(pb))-1)
+    page=page_cache().entry(pb,pg)["page"]
     spans=[]; all_c={}; fonts={}
 
-    for block in page.get_text("dict",flags=fitz.TEXT_PRESERVE_WHITESPACE)["blocks"]:
+    for block in page_parsed(pb,pg,"dict")["blocks"]:
         if block.get("type")!=0: continue
         for line in block.get("lines",[]):
             for sp in line.get("spans",[]):
@@ -877,7 +1905,7 @@ def inspect_page(pb:bytes,pg:int=0)->Dict:
 
     pi={"width":round(page.rect.width,1),"height":round(page.rect.height,1),
         "rotation":page.rotation}
-    img_n=len(page.get_images(full=True)); doc.close()
+    img_n=len(page.get_images(full=True))
 
     fs=[{"Font Name":fn,"Used":fd["count"],
          "Sizes":  ", ".join(str(s) for s in sorted(fd["sizes"])),
@@ -968,19 +1996,25 @@ function st(msg){{var t=document.getElementById('t');t.textContent=msg;
     st.markdown("### ✏️ PDF Find & Replace Editor")
     up=st.file_uploader("📂 Upload PDF",type=["pdf"],key="v_up")
     if up:
-        pb=get_pdf_bytes(up)
+        pb=spool_upload(up)
         ok,msg,pgs=validate_pdf(pb)
         if not ok: st.error(f"❌ {msg}")
         else:
             st.success(f"✅ {msg}")
-            st.session_state.viewer_pdf_bytes=pb
-            doc=fitz.open(stream=pb,filetype="pdf")
-            with st.expander("📊 PDF Info",expanded=False): pdf_info(doc,pb)
-            doc.close()
+            lost=spool_lost()
+            if lost: st.info("ℹ️ This session's edit files expired — starting over from the upload.")
+            if lost or st.session_state.viewer_src!=pdf_key(pb):
+                # new upload (or expired edits) — edits and undo history start over
+                old=[e["snap"] for e in st.session_state.undo_stack]+[st.session_state.viewer_pdf]
+                st.session_state.viewer_src=pdf_key(pb)
+                st.session_state.viewer_pdf=pb; st.session_state.undo_stack=[]
+                for p in old: release_spool(p)
+            with st.expander("📊 PDF Info",expanded=False):
+                with pdf_lock(pb) as d: pdf_info(d,pb)
 
             c_l,c_r=st.columns([1,2])
             with c_l: ppg=st.number_input("Preview Page",1,pgs,1,key="vp")
-            with c_r: st.image(render_preview(pb,ppg-1,110),
+            with c_r: st.image(render_preview(st.session_state.viewer_pdf,ppg-1,110),
                                caption=f"Page {ppg}/{pgs}",use_container_width=True)
             st.divider()
             st.markdown("#### ✏️ Find & Replace")
@@ -991,10 +2025,23 @@ function st(msg){{var t=document.getElementById('t');t.textContent=msg;
             vfont=c1.selectbox("Font",FONT_NAMES,key="vfont")
             vsz=c2.number_input("Size",4.0,72.0,12.0,0.5,key="vsz")
             vcs=c3.checkbox("Case Sensitive",True,key="vcs")
+            c1,c2=st.columns(2)
+            vww=c1.checkbox("Whole Word",key="vww")
+            vrx=c2.checkbox("Regex",key="vrx",help="Python regex; use \\1 or \\g<name> in Replace")
             c1,c2,c3,c4=st.columns(4)
             vbd=c1.checkbox("Bold",key="vbd"); vit=c2.checkbox("Italic",key="vit")
             vtc=c3.color_picker("Text","#000000",key="vtc")
             vbc=c4.color_picker("BG","#FFFFFF",key="vbc")
+            vsave=st.selectbox("💾 Save Mode",SAVE_MODES,key="vsave",
+                               help="auto: fast save when few pages change · full: compact "
+                                    "+ de-duplicate rewrite · fast: skip compaction")
+
+            if st.button("👁 Preview Hits",use_container_width=True,key="vprev"):
+                if not vf: st.warning("⚠️ Enter find text.")
+                else:
+                    try: show_hit_preview(st.session_state.viewer_pdf,
+                                          find_hits(st.session_state.viewer_pdf,vf,vcs,vrx,vww))
+                    except Exception as e: st.error(f"❌ {e}")
 
             if st.button("✨ Apply Replace",use_container_width=True,key="vapp"):
                 if not vf: st.warning("⚠️ Enter find text.")
@@ -1002,12 +2049,14 @@ function st(msg){{var t=document.getElementById('t');t.textContent=msg;
                 else:
                     with st.spinner("Processing..."):
                         try:
-                            push_undo(st.session_state.viewer_pdf_bytes)
-                            nb,cnt=smart_replace(st.session_state.viewer_pdf_bytes,
-                                                 vf,vr,vfont,vsz,vtc,vbc,vbd,vit,vcs)
+                            op=dict(find=vf,repl=vr,font=vfont,size=vsz,tc=vtc,bgc=vbc,
+                                    bold=vbd,italic=vit,case=vcs,save=vsave,regex=vrx,whole=vww)
+                            nb,cnt=smart_replace(st.session_state.viewer_pdf,**op)
                             if cnt==0: st.warning("⚠️ Not found.")
                             else:
-                                st.session_state.viewer_pdf_bytes=nb
+                                push_undo(st.session_state.viewer_pdf,"replace",op,
+                                          f"'{vf}' → '{vr}' ({cnt}×)")
+                                st.session_state.viewer_pdf=spool_bytes(nb)
                                 st.success(f"✅ Replaced {cnt}×!")
                                 download_btn(nb,"edited.pdf"); open_in_new_tab(nb)
                                 whatsapp_share()
@@ -1064,10 +2113,66 @@ function sh(m){{var t=document.getElementById('t');t.textContent=m;
 </script></body></html>""", height=72)
                         except Exception as e: st.error(f"❌ {e}")
 
+            with st.expander("📋 Batch Find & Replace",expanded=False):
+                st.caption("One pair per line as `find => replace` (or tab-separated), "
+                           "or upload a CSV with find / replace columns. "
+                           "Font, size, colors, case and whole-word come from the options above.")
+                btxt=st.text_area("Pairs",key="btxt",height=140,
+                                  placeholder="John Smith => Jane Doe\n2023-01-01 => 2024-01-01")
+                bcsv=st.file_uploader("📂 Pairs CSV",type=["csv"],key="bcsv")
+                if st.button("✨ Apply Batch Replace",use_container_width=True,key="bapp"):
+                    try:
+                        pairs=parse_pairs(btxt)
+                        if bcsv:
+                            cdf=pd.read_csv(bcsv,dtype=str,keep_default_na=False)
+                            cols=csv_pair_cols(cdf.columns)
+                            if cols is None:
+                                # no find / replace header: the first row is data too
+                                bcsv.seek(0); cdf=pd.read_csv(bcsv,dtype=str,keep_default_na=False,header=None)
+                                if len(cdf.columns)<2: raise ValueError("CSV needs a find and a replace column.")
+                                st.warning("⚠️ No find / replace headers in the CSV — using its first two columns.")
+                                cols=list(cdf.columns[:2])
+                            pairs+=[(f.strip(),r) for f,r in cdf[cols].itertuples(index=False) if f.strip()]
+                        if not pairs: st.warning("⚠️ Add at least one pair.")
+                        else:
+                            with st.spinner(f"Replacing {len(pairs)} pattern(s)..."):
+                                op=dict(pairs=pairs,font=vfont,size=vsz,tc=vtc,bgc=vbc,bold=vbd,
+                                        italic=vit,save=vsave,case=vcs,whole=vww)
+                                nb,counts=batch_replace(st.session_state.viewer_pdf,**op)
+                                tot=sum(counts.values())
+                                if tot==0: st.warning("⚠️ Nothing found.")
+                                else:
+                                    push_undo(st.session_state.viewer_pdf,"batch_replace",op,
+                                              f"batch of {len(pairs)} pair(s) ({tot}×)")
+                                    st.session_state.viewer_pdf=spool_bytes(nb)
+                                    st.success(f"✅ Replaced {tot}× across {len(counts)} pattern(s)!")
+                                    st.dataframe(pd.DataFrame(counts.items(),columns=["Find","Hits"]),
+                                                 use_container_width=True,hide_index=True)
+                                    download_btn(nb,"edited.pdf"); open_in_new_tab(nb)
+                    except Exception as e:
+                        st.error(f"❌ {e}"); logger.exception("Batch replace error")
+
+            with st.expander("⏱ Save Benchmark",expanded=False):
+                st.caption("Runs this replace once per save mode and compares latency and size.")
+                if st.button("⏱ Run Benchmark",key="vbench"):
+                    if not vf: st.warning("⚠️ Enter find text.")
+                    else:
+                        with st.spinner("Benchmarking..."):
+                            st.dataframe(bench_save_modes(st.session_state.viewer_pdf,
+                                                          vf,vr or vf),
+                                         use_container_width=True,hide_index=True)
+
             if st.session_state.undo_stack:
-                if st.button("↩ Undo",key="vundo"):
-                    st.session_state.viewer_pdf_bytes=pop_undo()
+                log=st.session_state.undo_stack
+                if st.button(f"↩ Undo {log[-1]['label']}",key="vundo"):
+                    with st.spinner("Restoring..."):
+                        cur=st.session_state.viewer_pdf
+                        st.session_state.viewer_pdf=spool_bytes(pop_undo()); release_spool(cur)
                     st.success("↩ Done!"); st.rerun()
+                with st.expander(f"🕘 History ({len(log)} step(s))",expanded=False):
+                    for i,e in enumerate(reversed(log),1):
+                        st.caption(f"{i}. {e['label'] or e['op']}"
+                                   f"{' · 💾 snapshot' if e['snap'] is not None else ''}")
 
 
 # ══════════════════════════════════
@@ -1079,7 +2184,7 @@ with tabs[1]:
 
     up1=st.file_uploader("📂 Upload PDF",type=["pdf"],key="ins_up")
     if up1:
-        pb1=get_pdf_bytes(up1)
+        pb1=spool_upload(up1)
         ok,msg,tp=validate_pdf(pb1)
         if not ok: st.error(f"❌ {msg}")
         else:
@@ -1486,6 +2591,9 @@ render();
             ifnt=c1.selectbox("Font",FONT_NAMES,key="ifnt")
             isz=c2.number_input("Size",4.0,72.0,12.0,0.5,key="isz")
             ics=c3.checkbox("Case Sensitive",True,key="ics")
+            c1,c2=st.columns(2)
+            iww=c1.checkbox("Whole Word",key="iww")
+            irx=c2.checkbox("Regex",key="irx",help="Python regex; use \\1 or \\g<name> in Replace")
             c1,c2,c3,c4=st.columns(4)
             ibd=c1.checkbox("Bold",key="ibd"); iit=c2.checkbox("Italic",key="iit")
             itc=c3.color_picker("Text","#000000",key="itc")
@@ -1495,31 +2603,22 @@ render();
                             [f"Only Page {ipg if up1 else 1}","All Pages"],
                             horizontal=True,key="iscope")
 
+            if st.button("👁 Preview Hits",use_container_width=True,key="iprev"):
+                if not if_: st.warning("⚠️ Find text daalo.")
+                else:
+                    try: show_hit_preview(pb1,find_hits(pb1,if_,ics,irx,iww,
+                                          None if "All Pages" in iscope else [ipg-1]))
+                    except Exception as e: st.error(f"❌ {e}")
+
             if st.button("✨ Apply Replace",use_container_width=True,key="iapp"):
                 if not if_: st.warning("⚠️ Find text daalo.")
                 elif not ir_: st.warning("⚠️ Replace text daalo.")
                 else:
                     with st.spinner("Processing..."):
                         try:
-                            push_undo(pb1)
-                            if "All Pages" in iscope:
-                                rb,_=smart_replace(pb1,if_,ir_,ifnt,isz,itc,ibc,ibd,iit,ics)
-                            else:
-                                doc_t=fitz.open(stream=pb1,filetype="pdf")
-                                tot_t=len(doc_t); doc_t.close()
-                                parts=[]
-                                if ipg>1:
-                                    bfr=split_range(pb1,f"1-{ipg-1}")
-                                    parts.append(list(bfr.values())[0])
-                                single=split_range(pb1,str(ipg))
-                                es,_=smart_replace(list(single.values())[0],
-                                                   if_,ir_,ifnt,isz,itc,ibc,ibd,iit,ics)
-                                parts.append(es)
-                                if ipg<tot_t:
-                                    aft=split_range(pb1,f"{ipg+1}-{tot_t}")
-                                    parts.append(list(aft.values())[0])
-                                rb=merge_pdfs(parts) if len(parts)>1 else es
-
+                            rb,_=smart_replace(pb1,if_,ir_,ifnt,isz,itc,ibc,ibd,iit,ics,
+                                               pages=None if "All Pages" in iscope else [ipg-1],
+                                               regex=irx,whole=iww)
                             st.success("✅ Replace ho gaya!")
                             download_btn(rb,"edited.pdf"); open_in_new_tab(rb)
                         except Exception as e:
@@ -1534,26 +2633,37 @@ with tabs[2]:
     st.subheader("🖼 Extract Images from PDF")
     up2=st.file_uploader("📂 Upload PDF",type=["pdf"],key="img_up")
     if up2:
-        pb2=get_pdf_bytes(up2)
+        pb2=spool_upload(up2)
         ok,msg,_=validate_pdf(pb2)
         if not ok: st.error(f"❌ {msg}")
         else:
             if st.button("🔍 Extract Images",use_container_width=True):
-                with st.spinner("Extracting..."): imgs=extract_images(pb2)
+                with st.spinner("Extracting..."): zf_,imgs=images_zip(pb2)
+                # kept across reruns so paging the gallery doesn't re-extract
+                st.session_state.img_extract={"key":pdf_key(pb2),"zip":zf_,"imgs":imgs}
+            ix=st.session_state.img_extract
+            if ix and ix["key"]==pdf_key(pb2):
+                imgs=ix["imgs"]
                 if not imgs: st.warning("No images found.")
                 else:
-                    st.success(f"✅ Found {len(imgs)} image(s)")
-                    zb=io.BytesIO()
-                    with zipfile.ZipFile(zb,'w',zipfile.ZIP_DEFLATED) as zf:
-                        for img in imgs:
-                            zf.writestr(f"p{img['page']}_i{img['index']}.{img['ext']}",img['data'])
-                    st.download_button("⬇ Download All (ZIP)",zb.getvalue(),
+                    nu=sum(len(img['uses']) for img in imgs)
+                    st.success(f"✅ Found {len(imgs)} distinct image(s) in {nu} placement(s)")
+                    ix["zip"].seek(0)
+                    st.download_button("⬇ Download All (ZIP)",ix["zip"].read(),
                                        "images.zip","application/zip",use_container_width=True)
+                    GP=12; npg=(len(imgs)+GP-1)//GP
+                    gp=st.number_input(f"Gallery page (1–{npg})",1,npg,1,key="img_gp") if npg>1 else 1
                     cols=st.columns(3)
-                    for i,img in enumerate(imgs[:9]):
-                        cols[i%3].image(img['data'],
-                                        caption=f"P{img['page']} {img['width']}×{img['height']}",
-                                        use_container_width=True)
+                    for i,img in enumerate(imgs[(gp-1)*GP:gp*GP]):
+                        cap=f"P{img['page']} {img['width']}×{img['height']}" \
+                            +(f" · {len(img['uses'])}×" if len(img['uses'])>1 else "")
+                        if img['thumb']: cols[i%3].image(img['thumb'],caption=cap,use_container_width=True)
+                        else: cols[i%3].caption(f"{img['name']} — no preview · {cap}")
+                    with st.expander("📑 Placements",expanded=False):
+                        st.dataframe(pd.DataFrame([{"File":img['name'],"Size":f"{img['width']}×{img['height']}",
+                                                    "Uses":len(img['uses']),
+                                                    "Pages":", ".join(str(p) for p in sorted({u['page'] for u in img['uses']}))}
+                                                   for img in imgs]),use_container_width=True)
 
 
 # ══════════════════════════════════
@@ -1563,28 +2673,40 @@ with tabs[3]:
     st.subheader("📄 Extract Text from PDF")
     up3=st.file_uploader("📂 Upload PDF",type=["pdf"],key="txt_up")
     if up3:
-        pb3=get_pdf_bytes(up3)
+        pb3=spool_upload(up3)
         ok,msg,pg3=validate_pdf(pb3)
         if not ok: st.error(f"❌ {msg}")
         else:
-            c1,c2=st.columns(2)
+            c1,c2,c3=st.columns(3)
             tm=c1.selectbox("Mode",["plain","blocks","html"])
             pf=c2.text_input("Pages (blank=all)",placeholder="1, 3, 5-7")
+            twk=c3.number_input("Parallel Workers",1,MAX_WORKERS,min(4,MAX_WORKERS),key="twk",
+                                help=f"Used for selections of {2*TEXT_CHUNK}+ pages")
             if st.button("📄 Extract",use_container_width=True):
-                txts=extract_text(pb3,tm)
-                if pf.strip():
-                    sel=set()
-                    for p in pf.split(','):
-                        p=p.strip()
-                        if '-' in p: a,b=p.split('-'); sel.update(range(int(a),int(b)+1))
-                        elif p.isdigit(): sel.add(int(p))
-                    txts={p:t for p,t in txts.items() if p in sel}
-                if not txts: st.warning("No text.")
+                sel=parse_pages(pf,pg3)
+                if not sel: st.warning("No pages selected.")
                 else:
-                    full="\n\n".join(f"--- Page {p} ---\n{t}" for p,t in txts.items())
-                    st.text_area("Text",full,height=350)
-                    st.download_button("⬇ Download .txt",full.encode(),
-                                       "text.txt","text/plain",use_container_width=True)
+                    # stream: show the latest pages as they are extracted, redraw at most ~4×/s
+                    pbar=st.progress(0.0); live=st.empty(); parts=[]; t0=0.0; found=False
+                    for i,(p,t) in enumerate(extract_text(pb3,tm,sel,twk),1):
+                        parts.append(f"--- Page {p} ---\n{t}"); found=found or bool(t.strip())
+                        if time.perf_counter()-t0>0.25 or i==len(sel):
+                            pbar.progress(i/len(sel),text=f"Page {p} ({i}/{len(sel)})")
+                            live.code("\n\n".join(parts[-3:])[-4000:],language=None)
+                            t0=time.perf_counter()
+                    pbar.empty(); live.empty(); full="\n\n".join(parts)
+                    if not found: st.warning("No text.")
+                    else:
+                        st.text_area("Text",full,height=350)
+                        st.download_button("⬇ Download .txt",full.encode(),
+                                           "text.txt","text/plain",use_container_width=True)
+            with st.expander("⏱ Extraction Benchmark",expanded=False):
+                st.caption("Extracts the selected pages serially and with the worker pool and compares throughput.")
+                if st.button("⏱ Run Benchmark",key="tbench"):
+                    with st.spinner("Benchmarking..."):
+                        try: st.dataframe(bench_text(pb3,tm,parse_pages(pf,pg3),twk),
+                                          use_container_width=True,hide_index=True)
+                        except ValueError as e: st.warning(f"⚠️ {e}")
 
 
 # ══════════════════════════════════
@@ -1594,25 +2716,57 @@ with tabs[4]:
     st.subheader("📊 Extract Tables from PDF")
     up4=st.file_uploader("📂 Upload PDF",type=["pdf"],key="tbl_up")
     if up4:
-        pb4=get_pdf_bytes(up4)
-        ok,msg,_=validate_pdf(pb4)
+        pb4=spool_upload(up4)
+        ok,msg,tp4=validate_pdf(pb4)
         if not ok: st.error(f"❌ {msg}")
         else:
+            c1,c2,c3,c4=st.columns(4)
+            tpf=c1.text_input("Pages (blank=all)",placeholder="1, 3, 5-7",key="tbl_pf")
+            tst=c2.selectbox("Strategy",TABLE_STRATEGIES,key="tbl_st")
+            tbw=c3.number_input("Parallel Workers",1,MAX_WORKERS,min(4,MAX_WORKERS),key="tbl_wk")
+            tms=c4.slider("Prefilter",0.0,1.0,TABLE_MIN_SCORE,0.05,key="tbl_ms",
+                          help="Skip pages whose ruling-line / column-alignment score is below this (0 = off)")
             if st.button("📊 Find Tables",use_container_width=True):
-                with st.spinner("Detecting..."): all_t=extract_tables(pb4)
+                sel=parse_pages(tpf,tp4); pbar=st.progress(0.0); all_t={}; skipped=[]
+                for i,(pn,dfs) in enumerate(iter_tables(pb4,sel,tst,tbw,tms),1):
+                    if dfs is None: skipped.append(pn)
+                    elif dfs: all_t[pn]=dfs
+                    pbar.progress(i/len(sel),text=f"Page {pn} ({i}/{len(sel)})")
+                pbar.empty()
+                # kept across reruns: switching the export format doesn't re-detect
+                st.session_state.tables={"key":pdf_key(pb4),"tables":all_t,
+                                         "skipped":skipped,"pages":len(sel)}
+            tb=st.session_state.tables
+            if tb and tb["key"]==pdf_key(pb4):
+                all_t=tb["tables"]
+                if tb["skipped"]:
+                    sk=tb["skipped"]
+                    st.info(f"⏭ Prefilter skipped {len(sk)} of {tb['pages']} page(s) with no table signal: "
+                            +", ".join(map(str,sk[:30]))+(" …" if len(sk)>30 else ""))
                 if not all_t: st.warning("No tables detected.")
                 else:
-                    st.success(f"✅ Found {sum(len(v) for v in all_t.values())} table(s)")
-                    xl=io.BytesIO()
-                    with pd.ExcelWriter(xl,engine='openpyxl') as w:
-                        for pn,dfs in all_t.items():
-                            for i,df in enumerate(dfs):
-                                st.markdown(f"**Page {pn} — Table {i+1}**")
-                                st.dataframe(df,use_container_width=True)
-                                df.to_excel(w,sheet_name=f"P{pn}_T{i+1}",index=False)
-                    st.download_button("⬇ Download Excel",xl.getvalue(),"tables.xlsx",
-                        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        use_container_width=True)
+                    tl=list(iter_table_list(all_t)); nb_=(len(tl)+TABLE_BROWSE-1)//TABLE_BROWSE
+                    st.success(f"✅ Found {len(tl)} table(s)")
+                    bp=st.number_input(f"Browse tables (page 1–{nb_})",1,nb_,1,key="tbl_bp") if nb_>1 else 1
+                    for name,df in tl[(bp-1)*TABLE_BROWSE:bp*TABLE_BROWSE]:
+                        pn_,ti_=name[1:].split("_T")
+                        st.markdown(f"**Page {pn_} — Table {ti_}** · {len(df)}×{len(df.columns)}")
+                        st.dataframe(df,use_container_width=True)
+                    fmts=[f for f in TABLE_FORMATS if f!="Parquet (ZIP)" or parquet_ok()]
+                    tfmt=TABLE_FORMATS[st.selectbox("Export Format",fmts,key="tbl_fmt")]
+                    # built once per format, then kept with the detected tables
+                    ex=tb.setdefault("exports",{})
+                    if tfmt not in ex:
+                        with st.spinner("Building export..."):
+                            ex[tfmt]=tables_xlsx(all_t) if tfmt=="xlsx" else tables_zip(all_t,tfmt)
+                    ex[tfmt].seek(0)
+                    if tfmt=="xlsx":
+                        st.download_button("⬇ Download Excel",ex[tfmt].read(),"tables.xlsx",
+                            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                            use_container_width=True)
+                    else:
+                        st.download_button(f"⬇ Download {tfmt.upper()} (ZIP)",ex[tfmt].read(),
+                                           f"tables_{tfmt}.zip","application/zip",use_container_width=True)
 
 
 # ══════════════════════════════════
@@ -1622,7 +2776,7 @@ with tabs[5]:
     st.subheader("📑 Reorder PDF Pages")
     up5=st.file_uploader("📂 Upload PDF",type=["pdf"],key="ro_up")
     if up5:
-        pb5=get_pdf_bytes(up5)
+        pb5=spool_upload(up5)
         ok,msg,tp5=validate_pdf(pb5)
         if not ok: st.error(f"❌ {msg}")
         else:
@@ -1647,7 +2801,7 @@ with tabs[6]:
     st.subheader("✍ Add Signature")
     up6=st.file_uploader("📂 Upload PDF",type=["pdf"],key="sig_up")
     if up6:
-        pb6=get_pdf_bytes(up6)
+        pb6=spool_upload(up6)
         ok,msg,tp6=validate_pdf(pb6)
         if not ok: st.error(f"❌ {msg}")
         else:
@@ -1689,7 +2843,7 @@ with tabs[7]:
     st.subheader("💧 Watermark Tools")
     up7=st.file_uploader("📂 Upload PDF",type=["pdf"],key="wm_up")
     if up7:
-        pb7=get_pdf_bytes(up7)
+        pb7=spool_upload(up7)
         ok,msg,tp7=validate_pdf(pb7)
         if not ok: st.error(f"❌ {msg}")
         else:
@@ -1726,29 +2880,61 @@ with tabs[8]:
     else:
         up8=st.file_uploader("📂 Upload PDF (scanned)",type=["pdf"],key="ocr_up")
         if up8:
-            pb8=get_pdf_bytes(up8)
+            pb8=spool_upload(up8)
             ok,msg,tp8=validate_pdf(pb8)
             if not ok: st.error(f"❌ {msg}")
             else:
-                c1,c2=st.columns(2)
+                c1,c2,c3=st.columns(3)
                 olang=c1.selectbox("Language",["eng","hin","spa","fra","deu","ara","chi_sim"])
                 odpi=c2.select_slider("DPI",[100,150,200,300],value=200)
+                owk=c3.number_input("Parallel Workers",1,MAX_WORKERS,
+                                    min(4,MAX_WORKERS),key="owk")
+                ohy=st.checkbox("⚡ Hybrid — use the text layer where a page already has one",
+                                True,key="ohy")
                 if st.button("🔍 Run OCR",use_container_width=True):
-                    with st.spinner(f"OCR on {tp8} pages..."):
-                        try:
-                            prog=st.progress(0)
-                            res=run_ocr(pb8,olang,odpi); prog.progress(1.0)
-                            tw=sum(r['word_count'] for r in res.values())
-                            ac=round(sum(r['confidence'] for r in res.values())/len(res),1)
-                            c1,c2,c3=st.columns(3)
-                            c1.metric("Pages",tp8); c2.metric("Words",tw)
-                            c3.metric("Avg Conf",f"{ac}%")
-                            full="\n\n".join(f"=== Page {p} ===\n{r['text']}"
-                                             for p,r in res.items())
-                            st.text_area("OCR Output",full,height=320)
-                            st.download_button("⬇ Download",full.encode(),
-                                               "ocr.txt","text/plain",use_container_width=True)
-                        except Exception as e: st.error(f"❌ {e}")
+                    # Completed pages land in session state as they arrive, so they
+                    # survive a Stop, a failure on a later page, or a rerun.
+                    part=st.session_state.ocr_partial={"key":pdf_key(pb8),"pages":{},
+                                                       "done":False,"error":None}
+                    prog=st.progress(0.0,text=f"OCR on {tp8} pages...")
+                    live=st.empty()
+                    try:
+                        for i,(p,r) in enumerate(iter_ocr(pb8,olang,odpi,owk,ohy),1):
+                            part["pages"][p]=r
+                            prog.progress(i/tp8,text=f"Page {p} done ({i}/{tp8})")
+                            live.code(f"=== Page {p} ===\n{r['text']}"[-3000:],language=None)
+                        part["done"]=True
+                    except Exception as e:
+                        part["error"]=str(e); logger.exception("OCR error")
+                    live.empty()
+
+                part=st.session_state.ocr_partial
+                if part and part["key"]==pdf_key(pb8) and part["error"]:
+                    st.error(f"❌ Stopped at page {len(part['pages'])+1}: {part['error']}")
+                if part and part["key"]==pdf_key(pb8) and part["pages"]:
+                    res=dict(sorted(part["pages"].items()))
+                    if not part["done"]:
+                        st.warning(f"⚠️ Partial result — {len(res)} of {tp8} pages.")
+                    tw=sum(r['word_count'] for r in res.values())
+                    oc=[r['confidence'] for r in res.values() if r['path']=="ocr"]
+                    ac=f"{round(sum(oc)/len(oc),1)}%" if oc else "—"
+                    c1,c2,c3,c4=st.columns(4)
+                    c1.metric("Pages",f"{len(res)}/{tp8}"); c2.metric("Words",tw)
+                    c3.metric("OCR'd",len(oc)); c4.metric("Avg Conf",ac)
+                    if any("text_chars" in r for r in res.values()):
+                        with st.expander("🧭 Hybrid Report",expanded=False):
+                            st.dataframe(pd.DataFrame([{"Page":p,"Path":r['path'],
+                                "Text chars":r.get('text_chars'),"Image cover":r.get('img_cover')}
+                                for p,r in res.items()]),use_container_width=True,hide_index=True)
+                    full="\n\n".join(f"=== Page {p} ===\n{r['text']}"
+                                     for p,r in res.items())
+                    st.text_area("OCR Output",full,height=320)
+                    st.download_button("⬇ Download",full.encode(),
+                                       "ocr.txt","text/plain",use_container_width=True)
+                    wdf=pd.concat([r['words'].assign(page=p) for p,r in res.items()],
+                                  ignore_index=True)
+                    st.download_button("⬇ Word Boxes (CSV)",wdf.to_csv(index=False).encode(),
+                                       "ocr_words.csv","text/csv",use_container_width=True)
 
 
 # ══════════════════════════════════
@@ -0,0 +1,94 @@
+"""
+Pro PDF Studio — process-pool side.
+Everything a pool worker runs lives here, importable on its own (no Streamlit),
+so spawn / forkserver children can resolve the task functions by module name.
+"""
+
+import os
+import fitz
+import pandas as pd
+from collections import OrderedDict
+from typing import Optional, Tuple, List, Dict, Union
+
+PdfSrc=Union[bytes,str]  # PDF bytes, or the path of a (spooled) PDF file
+
+def load_pdf(src:PdfSrc)->fitz.Document:
+    # private, writable handle — file sources are read lazily by MuPDF
+    return fitz.open(src) if isinstance(src,str) else fitz.open(stream=src,filetype="pdf")
+
+# ═══════════════════════════════════════════════
+# PAGE HELPERS  (shared with the app)
+# ═══════════════════════════════════════════════
+OCR_WORD_COLS=["block","par","line","word","left","top","width","height","conf","text"]
+
+def ocr_words(cd:Dict)->pd.DataFrame:
+    # word-level rows (level 5) of a tesseract image_to_data dict
+    df=pd.DataFrame(cd)
+    if df.empty: return pd.DataFrame(columns=OCR_WORD_COLS)
+    df=df.rename(columns={"block_num":"block","par_num":"par",
+                          "line_num":"line","word_num":"word"})
+    df["text"]=df["text"].fillna("").astype(str)
+    df=df[(df["level"]==5)&(df["text"].str.strip()!="")]
+    df=df.assign(conf=pd.to_numeric(df["conf"],errors="coerce").fillna(-1).astype(float))
+    return df[OCR_WORD_COLS].reset_index(drop=True)
+
+def words_to_text(df:pd.DataFrame)->str:
+    # same layout as image_to_string: words by space, lines by \n, paragraphs by a blank line
+    out=[]; prev=None
+    for (b,p,_),g in df.groupby(["block","par","line"],sort=False):
+        if prev is not None: out.append("\n" if (b,p)==prev else "\n\n")
+        out.append(" ".join(g["text"])); prev=(b,p)
+    return "".join(out)
+
+def ocr_page(page,lang="eng",dpi=200)->Dict:
+    import pytesseract; from PIL import Image
+    # Render straight to 8-bit gray and wrap the samples — no PNG round trip,
+    # a third of the RGB buffer. img borrows pix's memory, so drop it first.
+    pix=page.get_pixmap(dpi=dpi,colorspace=fitz.csGRAY,alpha=False)
+    img=Image.frombuffer("L",(pix.width,pix.height),pix.samples_mv,"raw","L",pix.stride,1)
+    words=ocr_words(pytesseract.image_to_data(img,lang=lang,
+                                              output_type=pytesseract.Output.DICT))
+    del img
+    confs=words["conf"][words["conf"]>0]
+    return {"text":words_to_text(words),"word_count":len(words),
+            "confidence":round(float(confs.mean()),1) if len(confs) else 0.0,
+            "words":words,"path":"ocr"}
+
+def page_text(page:fitz.Page,mode:str="plain",tp:Optional[fitz.TextPage]=None)->str:
+    if mode=="html": return page.get_text("html")   # keeps images: own TextPage flags
+    if mode=="blocks": return "\n".join(b[4] for b in page.get_text("blocks",textpage=tp))
+    return page.get_text(textpage=tp)
+
+def page_tables(page:fitz.Page,strategy:str="lines")->List[List[List]]:
+    # raw cell rows of every table on the page, header row first
+    # (find_tables takes no TextPage argument and always builds its own)
+    try: return [rows for tab in page.find_tables(strategy=strategy) for rows in [tab.extract()] if rows]
+    except: return []
+
+# ═══════════════════════════════════════════════
+# WORKER ENTRY POINTS
+# ═══════════════════════════════════════════════
+WORKER_DOCS=2   # open documents each worker keeps between tasks
+_DOCS=OrderedDict()
+
+def init_worker():
+    os.environ["OMP_THREAD_LIMIT"]="1"   # tesseract: one thread per process
+
+def worker_doc(src:str)->fitz.Document:
+    # tasks name the PDF file they read; reopen only on a miss
+    doc=_DOCS.pop(src,None) or load_pdf(src)
+    _DOCS[src]=doc
+    while len(_DOCS)>WORKER_DOCS: _DOCS.popitem(last=False)[1].close()
+    return doc
+
+def ocr_task(args)->Tuple[int,Dict]:
+    src,pn,lang,dpi=args
+    return pn,ocr_page(worker_doc(src)[pn],lang,dpi)
+
+def text_task(args)->List[Tuple[int,str]]:
+    src,pages,mode=args; doc=worker_doc(src)
+    return [(pn+1,page_text(doc[pn],mode)) for pn in pages]
+
+def table_task(args)->List[List[List]]:
+    src,pn,strategy=args
+    return page_tables(worker_doc(src)[pn],strategy)